@@ -0,0 +1,178 @@
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import threading
+from logtail import TailedLogs
+from apache_log import LineParser, LogAggregate
+
+
+class AccessLogs(TailedLogs):
+    """Tails a set of access logs into a pending LogAggregate."""
+
+    kind = "access"
+
+    def __init__(self, ingest="inotify", logger=None):
+        # Parsers are shared by every log using the same format string
+        self.parsers = {}
+        self.formats = {}
+        super().__init__(ingest, logger)
+
+    def new_aggregate(self):
+        return LogAggregate()
+
+    def parse(self, filename, lines, aggregate):
+        parser = self.parsers[self.formats[filename]]
+        for line in lines:
+            aggregate.add(filename, parser(line))
+
+    def add_log(self, filename, logformat):
+        if logformat not in self.parsers:
+            self.parsers[logformat] = LineParser(logformat)
+        self.formats[filename] = logformat
+        super().add_log(filename)
+
+    def remove_log(self, filename):
+        super().remove_log(filename)
+        self.formats.pop(filename, None)
+
+
+def shard_worker(connection, ingest, log_queue):
+    parent = os.getppid()
+    # The inherited handlers write to files the parent rotates, log through the parent instead
+    logger = logging.getLogger("brixmond")
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.propagate = False
+    logs = AccessLogs(ingest, logger)
+    while True:
+        try:
+            if not connection.poll(5):
+                if os.getppid() != parent:
+                    # brixmond went away without closing the pipe
+                    return
+                continue
+            command, args = connection.recv()
+        except EOFError:
+            return
+        if command == "add":
+            logs.add_log(*args)
+        elif command == "remove":
+            logs.remove_log(*args)
+        elif command == "start":
+            logs.start()
+        elif command == "take":
+            connection.send(logs.take())
+        elif command == "close":
+            logs.close()
+            return
+
+
+class AccessLogPool(object):
+    """Shards access logs over worker processes, each with its own AccessLogs.
+
+    Workers keep their own tail offsets and parsers and only send their
+    partial aggregate back on take(). Partials are merged in worker order.
+    Status counts, times and bytes match reading every file in a single
+    process, the top paths are approximate like there once a vhost has more
+    than max_paths distinct paths. Workers log through a queue that is
+    handled by logger in this process.
+    """
+
+    kind = "access"
+
+    def __init__(self, workers, ingest="inotify", logger=None):
+        self.ingest = ingest
+        self.logger = logger or logging.getLogger("brixmond")
+        # brixmond.py isn't importable as a module, so spawn and forkserver can't be used
+        self.context = multiprocessing.get_context("fork")
+        self.shards = [{} for _ in range(workers)]
+        self.log_queue = self.context.Queue()
+        threading.Thread(target=self.forward_logs, name="apache-logs", daemon=True).start()
+        self.workers = [self.spawn() for _ in range(workers)]
+        self.started = False
+        self.closed = False
+
+    def spawn(self):
+        parent, child = self.context.Pipe()
+        process = self.context.Process(target=shard_worker, args=(child, self.ingest, self.log_queue),
+                                       name="brixmond-apache", daemon=True)
+        process.start()
+        child.close()
+        return process, parent
+
+    def forward_logs(self):
+        while True:
+            record = self.log_queue.get()
+            if record is None:
+                return
+            self.logger.handle(record)
+
+    def add_log(self, filename, logformat):
+        index = min(range(len(self.shards)), key=lambda shard: len(self.shards[shard]))
+        self.shards[index][filename] = logformat
+        self.send(index, ("add", (filename, logformat)))
+
+    def remove_log(self, filename):
+        for index, shard in enumerate(self.shards):
+            if filename in shard:
+                del shard[filename]
+                self.send(index, ("remove", (filename,)))
+
+    def send(self, index, message):
+        try:
+            self.workers[index][1].send(message)
+        except OSError:
+            # Restarted with its whole shard on the next take()
+            pass
+
+    def start(self):
+        self.started = True
+        for index in range(len(self.workers)):
+            self.send(index, ("start", ()))
+
+    def close(self):
+        self.closed = True
+        for index, (process, connection) in enumerate(self.workers):
+            self.send(index, ("close", ()))
+            connection.close()
+        for process, connection in self.workers:
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
+        self.log_queue.put(None)
+
+    def restart(self, index):
+        if self.closed:
+            return
+        self.logger.error("Apache log worker {} died, restarting it".format(index))
+        process, connection = self.workers[index]
+        connection.close()
+        process.join(1)
+        self.workers[index] = self.spawn()
+        connection = self.workers[index][1]
+        for log in self.shards[index].items():
+            connection.send(("add", log))
+        if self.started:
+            connection.send(("start", ()))
+
+    def take(self):
+        if self.closed:
+            return LogAggregate()
+        # Ask every worker first so the shards are read in parallel
+        asked = []
+        for index, (process, connection) in enumerate(self.workers):
+            try:
+                connection.send(("take", ()))
+                asked.append(index)
+            except (OSError, EOFError):
+                self.restart(index)
+
+        aggregate = LogAggregate()
+        for index in asked:
+            try:
+                aggregate.merge(self.workers[index][1].recv())
+            except (OSError, EOFError):
+                self.restart(index)
+        return aggregate
@@ -0,0 +1,196 @@
+import glob
+import os
+import re
+import threading
+import time
+
+LAYOUTS = [
+    # Debian and Ubuntu
+    ("/etc/apache2", "apache2.conf", "/etc/apache2/envvars"),
+    # RHEL, CentOS and Fedora
+    ("/etc/httpd", "conf/httpd.conf", None),
+]
+
+DEFAULT_VARIABLES = {"APACHE_LOG_DIR": "/var/log/apache2"}
+
+regex_token = re.compile(r'"((?:[^"\\]|\\.)*)"|(\S+)')
+regex_variable = re.compile(r'\$\{(\w+)\}')
+regex_export = re.compile(r'^\s*export\s+(\w+)=(\S*)', re.MULTILINE)
+
+
+def tokenize(line):
+    """Split a directive in arguments, returns (value, quoted) tuples."""
+    tokens = []
+    for quoted, bare in regex_token.findall(line):
+        if bare:
+            tokens.append((bare, False))
+        else:
+            tokens.append((quoted.replace('\\"', '"'), True))
+    return tokens
+
+
+def parse_file(path):
+    """The directives of interest in one config file, in order, as (name, args) tuples."""
+    directives = []
+    with open(path, errors="replace") as handle:
+        pending = ""
+        for line in handle:
+            line = line.strip()
+            if line.endswith("\\"):
+                pending += line[:-1] + " "
+                continue
+            line, pending = pending + line, ""
+            if not line or line.startswith("#"):
+                continue
+            name = line.split(None, 1)[0].lower()
+            if name in ("include", "includeoptional", "logformat", "customlog", "transferlog", "errorlog", "define",
+                        "serverroot"):
+                directives.append((name, tokenize(line)[1:]))
+    return directives
+
+
+def read_envvars(path):
+    """Variables exported by the Debian envvars script, without running it."""
+    variables = {}
+    try:
+        with open(path) as handle:
+            content = handle.read()
+    except (IOError, OSError):
+        return variables
+    for name, value in regex_export.findall(content):
+        # $SUFFIX is only set for multiple instances
+        variables[name] = value.strip("'\"").replace("$SUFFIX", "")
+    return variables
+
+
+class ApacheConfig(object):
+    """Finds the access logs, error logs and log formats in the Apache config.
+
+    The config tree is walked from the main config file following Include and
+    IncludeOptional. Parsed directives are cached per file by mtime and size
+    and include globs by the mtime of their directory, so refresh() only reads
+    files that changed. One instance is shared by the Apache monitors, they
+    use refresh_every() so the tree is walked once per interval.
+    """
+
+    def __init__(self, layouts=None):
+        self.server_root = None
+        self.main_config = None
+        self.envvars = None
+        for server_root, main_config, envvars in layouts or LAYOUTS:
+            if os.path.isfile(os.path.join(server_root, main_config)):
+                self.server_root = server_root
+                self.main_config = os.path.join(server_root, main_config)
+                self.envvars = envvars
+                break
+        self.files = {}
+        self.listings = {}
+        self.accesslogs = {}
+        self.errorlogs = []
+        self.logformats = {}
+        self.lock = threading.Lock()
+        self.refreshed = None
+
+    def cached(self, path):
+        try:
+            stat = os.stat(path)
+        except (IOError, OSError):
+            return None
+        key = (stat.st_mtime_ns, stat.st_size)
+        entry = self.files.get(path)
+        if entry is None or entry[0] != key:
+            try:
+                entry = self.files[path] = (key, parse_file(path))
+            except (IOError, OSError):
+                return None
+        return entry[1]
+
+    def expand(self, pattern):
+        """The files an Include pattern matches, cached until their directory changes."""
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "*")
+        directory = os.path.dirname(pattern)
+        if glob.has_magic(directory):
+            # Like sites-*/*.conf, no single directory mtime covers the matches
+            return sorted(path for path in glob.glob(pattern) if os.path.isfile(path))
+        try:
+            key = os.stat(directory).st_mtime_ns
+        except (IOError, OSError):
+            return []
+        entry = self.listings.get(pattern)
+        if entry is None or entry[0] != key:
+            entry = self.listings[pattern] = (key, sorted(path for path in glob.glob(pattern) if os.path.isfile(path)))
+        return entry[1]
+
+    def resolve(self, path, variables):
+        path = regex_variable.sub(lambda match: variables.get(match.group(1), match.group(0)), path)
+        return os.path.join(self.server_root, path)
+
+    def refresh_every(self, interval):
+        """Refresh when the last refresh is at least interval seconds old."""
+        with self.lock:
+            if self.refreshed is None or time.time() - self.refreshed >= interval:
+                self.refreshed = time.time()
+                self.refresh()
+
+    def refresh(self):
+        """Re-read changed config files, returns whether the logs or formats changed."""
+        if self.main_config is None:
+            return False
+        variables = dict(DEFAULT_VARIABLES)
+        if self.envvars is not None:
+            variables.update(read_envvars(self.envvars))
+
+        accesslogs = {}
+        errorlogs = []
+        logformats = {}
+        visited = set()
+
+        def walk(path):
+            if path in visited:
+                return
+            visited.add(path)
+            for name, args in self.cached(path) or []:
+                if not args:
+                    continue
+                if name in ("include", "includeoptional"):
+                    for included in self.expand(self.resolve(args[0][0], variables)):
+                        walk(included)
+                elif name == "define" and len(args) > 1:
+                    variables[args[0][0]] = args[1][0]
+                elif name == "serverroot":
+                    self.server_root = args[0][0]
+                elif name == "logformat":
+                    if len(args) > 1:
+                        logformats[args[1][0]] = args[0][0]
+                    else:
+                        logformats["common"] = args[0][0]
+                elif name in ("customlog", "transferlog"):
+                    target = args[0][0]
+                    if target.startswith("|"):
+                        # Piped logs can't be tailed
+                        continue
+                    if name == "transferlog":
+                        nickname = "common"
+                    elif len(args) < 2:
+                        continue
+                    elif args[1][1]:
+                        # Inline format string
+                        nickname = args[1][0]
+                        logformats.setdefault(nickname, nickname)
+                    else:
+                        nickname = args[1][0]
+                    accesslogs[self.resolve(target, variables)] = nickname
+                elif name == "errorlog":
+                    target = args[0][0]
+                    if not target.startswith("|") and not target.startswith("syslog"):
+                        errorlogs.append(self.resolve(target, variables))
+
+        walk(self.main_config)
+
+        # Formats can be defined after the CustomLog referencing them
+        resolved = {path: logformats[nickname] for path, nickname in accesslogs.items() if nickname in logformats}
+        errorlogs = sorted(set(errorlogs))
+        changed = (resolved, errorlogs, logformats) != (self.accesslogs, self.errorlogs, self.logformats)
+        self.accesslogs, self.errorlogs, self.logformats = resolved, errorlogs, logformats
+        return changed
@@ -0,0 +1,344 @@
+import re
+import collections
+
+# Request time histogram bucket upper bounds in milliseconds
+TIME_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+regex_directive = re.compile(r'%([<>]?)(!?\d+(?:,\d+)*)?(?:\{([^}]*)\})?([a-zA-Z%])')
+regex_quoted = r'[^"\\]*(?:\\.[^"\\]*)*'
+
+
+class LineParser(object):
+    """Extract (status, microseconds, bytes, path, vhost) from access log lines.
+
+    Every LogFormat is compiled into one regex that only captures the fields
+    we aggregate, everything else is matched but not converted. Formats the
+    fast path can't handle use apache_log_parser instead. Fields missing
+    from the format are None.
+    """
+
+    def __init__(self, logformat):
+        self.logformat = logformat
+        self.regex, self.captures = self.compile(logformat)
+        self.fast = self.regex is not None
+        if not self.fast:
+            import apache_log_parser
+            self.full_parser = apache_log_parser.make_parser(logformat)
+
+    @staticmethod
+    def compile(logformat):
+        """Translate a LogFormat into a regex and its captured groups.
+
+        The regex is None when the fast path doesn't support the format.
+        """
+        captures = {}
+        pattern = []
+        position = 0
+        for match in regex_directive.finditer(logformat):
+            literal = logformat[position:match.start()]
+            pattern.append(re.escape(literal))
+            position = match.end()
+            redirect, conditions, argument, directive = match.groups()
+
+            quoted = literal.endswith('"') and logformat[position:position + 1] == '"'
+            if directive == '%':
+                pattern.append('%')
+                continue
+
+            group = None
+            if directive == 's':
+                # Prefer the final status (%>s) over the original one (%s)
+                group = 'status'
+                priority = 2 if redirect == '>' else 1
+                field = r'\d{3}|-'
+            elif directive == 'D':
+                group, priority, field = 'time', 4, r'-?\d+'
+            elif directive == 'T':
+                unit = (argument or 's').lower()
+                if unit not in ('s', 'ms', 'us'):
+                    return None, None
+                group, priority, field = 'time', {'us': 3, 'ms': 2, 's': 1}[unit], r'-?\d+'
+            elif directive in ('O', 'B', 'b'):
+                group, priority, field = 'bytes', {'O': 3, 'B': 2, 'b': 1}[directive], r'\d+|-'
+            elif directive == 'r':
+                group, priority, field = 'path', 2, regex_quoted
+            elif directive == 'U':
+                group, priority, field = 'path', 1, r'\S*'
+            elif directive in ('v', 'V'):
+                group, priority, field = 'vhost', 2 if directive == 'v' else 1, r'\S*'
+            elif directive == 't' and argument is None:
+                field = r'\[[^\]]*\]'
+            elif directive == 't' and not quoted:
+                if argument.split(':')[-1] not in ('sec', 'msec', 'usec', 'msec_frac', 'usec_frac'):
+                    # A strftime format can expand to anything, including spaces
+                    return None, None
+                field = r'\d+'
+            elif quoted:
+                field = regex_quoted
+            else:
+                field = r'\S*'
+
+            if group is not None and priority > captures.get(group, (0, None))[0]:
+                name = '{}_{}_{}'.format(group, directive, len(pattern))
+                captures[group] = (priority, name, directive, argument)
+                pattern.append('(?P<{}>{})'.format(name, field))
+            else:
+                pattern.append('(?:{})'.format(field))
+        pattern.append(re.escape(logformat[position:]))
+
+        if 'status' not in captures:
+            return None, None
+        try:
+            regex = re.compile(''.join(pattern) + '$')
+        except re.error:
+            return None, None
+        return regex, {group: capture[1:] for group, capture in captures.items()}
+
+    def __call__(self, line):
+        if self.fast:
+            return self.parse_fast(line)
+        return self.parse_full(line)
+
+    def parse_fast(self, line):
+        match = self.regex.match(line)
+        if match is None:
+            return None
+        captures = self.captures
+        status = match.group(captures['status'][0])
+        if status == '-':
+            return None
+
+        time_us = None
+        if 'time' in captures:
+            name, directive, argument = captures['time']
+            value = match.group(name)
+            unit = 'us' if directive == 'D' else (argument or 's').lower()
+            time_us = int(value) * {'us': 1, 'ms': 1000, 's': 1000000}[unit]
+
+        response_bytes = None
+        if 'bytes' in captures:
+            value = match.group(captures['bytes'][0])
+            response_bytes = 0 if value == '-' else int(value)
+
+        path = None
+        if 'path' in captures:
+            name, directive, argument = captures['path']
+            path = match.group(name)
+            if directive == 'r':
+                parts = path.split(' ')
+                path = parts[1] if len(parts) > 1 else None
+            if path is not None:
+                path = path.split('?', 1)[0]
+
+        vhost = match.group(captures['vhost'][0]) if 'vhost' in captures else None
+        return int(status), time_us, response_bytes, path, vhost
+
+    def parse_full(self, line):
+        try:
+            parsed = self.full_parser(line)
+        except Exception:
+            return None
+
+        time_us = None
+        if parsed.get('time_us') not in (None, ''):
+            time_us = int(parsed['time_us'])
+        elif parsed.get('time_s') not in (None, ''):
+            time_us = int(parsed['time_s']) * 1000000
+
+        response_bytes = None
+        for key in ('bytes_tx', 'response_bytes', 'response_bytes_clf'):
+            if key in parsed:
+                response_bytes = 0 if parsed[key] == '-' else int(parsed[key])
+                break
+
+        path = parsed.get('url_path') or parsed.get('request_url') or None
+        if path is not None:
+            path = path.split('?', 1)[0]
+        return int(parsed['status']), time_us, response_bytes, path, parsed.get('server_name')
+
+
+class VhostAggregate(object):
+    def __init__(self):
+        self.status = collections.Counter()
+        self.times = [0] * (len(TIME_BUCKETS) + 1)
+        self.bytes = 0
+        self.paths = collections.Counter()
+
+    def merge(self, other, max_paths):
+        self.status.update(other.status)
+        self.times = [a + b for a, b in zip(self.times, other.times)]
+        self.bytes += other.bytes
+        self.paths.update(other.paths)
+        if len(self.paths) > max_paths:
+            self.paths = collections.Counter(dict(top_paths(self.paths, max_paths // 2)))
+
+
+def top_paths(paths, count):
+    # Sorted by count and then path so results don't depend on insertion order
+    return sorted(paths.items(), key=lambda item: (-item[1], item[0]))[:count]
+
+
+class LogAggregate(object):
+    """Per vhost status counts, request time histogram, bytes sent and top paths.
+
+    Aggregates can be merged, which is deterministic regardless of the order
+    lines were added in. Distinct paths are capped at max_paths per vhost by
+    periodically keeping only the most requested half, so once a vhost has
+    more distinct paths the top paths are approximate and depend on where
+    the cut was made.
+    """
+
+    def __init__(self, max_paths=1000, top=10):
+        self.max_paths = max_paths
+        self.top = top
+        self.vhosts = collections.defaultdict(VhostAggregate)
+        self.lines = 0
+        self.invalid = 0
+
+    def add(self, vhost, fields):
+        self.lines += 1
+        if fields is None:
+            self.invalid += 1
+            return
+        status, time_us, response_bytes, path, logged_vhost = fields
+        aggregate = self.vhosts[logged_vhost or vhost]
+        aggregate.status[status] += 1
+        if time_us is not None:
+            bucket = 0
+            time_ms = time_us / 1000
+            while bucket < len(TIME_BUCKETS) and time_ms > TIME_BUCKETS[bucket]:
+                bucket += 1
+            aggregate.times[bucket] += 1
+        if response_bytes is not None:
+            aggregate.bytes += response_bytes
+        if path is not None:
+            aggregate.paths[path] += 1
+            if len(aggregate.paths) > self.max_paths:
+                aggregate.paths = collections.Counter(dict(top_paths(aggregate.paths, self.max_paths // 2)))
+
+    def merge(self, other):
+        self.lines += other.lines
+        self.invalid += other.invalid
+        for vhost in sorted(other.vhosts.keys()):
+            self.vhosts[vhost].merge(other.vhosts[vhost], self.max_paths)
+
+    def status_totals(self):
+        totals = collections.Counter()
+        for aggregate in self.vhosts.values():
+            totals.update(aggregate.status)
+        return dict(totals)
+
+    def to_point(self, detailed=False):
+        """The status totals, optionally with the per vhost breakdown."""
+        if not detailed:
+            return self.status_totals()
+        vhosts = {}
+        for vhost, aggregate in self.vhosts.items():
+            vhosts[vhost] = {
+                "status": dict(aggregate.status),
+                "time_ms": dict(zip([str(bound) for bound in TIME_BUCKETS] + ["inf"], aggregate.times)),
+                "bytes": aggregate.bytes,
+                "paths": dict(top_paths(aggregate.paths, self.top))
+            }
+        return {
+            "status": self.status_totals(),
+            "vhosts": vhosts,
+            "lines": self.lines,
+            "invalid": self.invalid
+        }
+
+
+# [time] [module:level] or [level] on 2.2, then the optional pid, errno and client fields
+regex_error_line = re.compile(r'\[[^\]]*\] \[(?:([\w-]*):)?(\w+)\](?: \[pid [^\]]*\])?(?: (\([-\d]+\)[^:\[]*):)?'
+                              r'(?: \[client [^\]]*\])?(?: \[remote [^\]]*\])? ?(.*)')
+regex_error_code = re.compile(r'\b(AH\d{5}):? ?')
+# Numbers, hex, addresses and quoted strings are replaced to group otherwise identical messages
+regex_error_variable = re.compile(r'\d[\w.:]*|\'[^\']*\'|"[^"]*"')
+
+
+def parse_error_line(line):
+    """Split an error log line into (module, level, code, message), None for continuation lines."""
+    match = regex_error_line.match(line)
+    if match is None:
+        return None
+    module, level, errno, message = match.groups()
+    code = regex_error_code.search(message)
+    if code is not None:
+        message = message[code.end():] if code.start() == 0 else message
+        code = code.group(1)
+    referer = message.rfind(", referer: ")
+    if referer != -1:
+        message = message[:referer]
+    if errno is not None:
+        message = "{}: {}".format(errno, message)
+    return module or None, level, code, message
+
+
+class ErrorAggregate(object):
+    """Error log line counts per severity, module and AH code plus the most frequent messages.
+
+    Messages are grouped by a fingerprint with the variable parts replaced.
+    At most max_messages fingerprints are kept, the least recently seen one
+    is dropped to make room so a storm of distinct messages can't grow the
+    aggregate without bound while the frequent ones stay.
+    """
+
+    def __init__(self, max_messages=1000, top=10):
+        self.max_messages = max_messages
+        self.top = top
+        # (module, level, code) counts, the breakdowns are summed from these when sending
+        self.classes = collections.Counter()
+        self.messages = collections.OrderedDict()
+        self.lines = 0
+        self.invalid = 0
+
+    def add(self, fields):
+        self.lines += 1
+        if fields is None:
+            self.invalid += 1
+            return
+        module, level, code, message = fields
+        self.classes[module, level, code] += 1
+        fingerprint = (module, level, code, regex_error_variable.sub("*", message))
+        entry = self.messages.get(fingerprint)
+        if entry is None:
+            self.messages[fingerprint] = entry = [0, message]
+            if len(self.messages) > self.max_messages:
+                self.messages.popitem(last=False)
+        else:
+            self.messages.move_to_end(fingerprint)
+        entry[0] += 1
+
+    def merge(self, other):
+        self.lines += other.lines
+        self.invalid += other.invalid
+        self.classes.update(other.classes)
+        for fingerprint, (count, message) in other.messages.items():
+            entry = self.messages.setdefault(fingerprint, [0, message])
+            entry[0] += count
+            self.messages.move_to_end(fingerprint)
+            if len(self.messages) > self.max_messages:
+                self.messages.popitem(last=False)
+
+    def top_messages(self):
+        items = sorted(self.messages.items(), key=lambda item: (-item[1][0], item[0][3]))[:self.top]
+        return [{"module": module, "level": level, "code": code, "message": message[:500], "count": count}
+                for (module, level, code, fingerprint), (count, message) in items]
+
+    def to_point(self):
+        levels = collections.Counter()
+        modules = collections.Counter()
+        codes = collections.Counter()
+        for (module, level, code), count in self.classes.items():
+            levels[level] += count
+            modules["{}:{}".format(module or "-", level)] += count
+            if code is not None:
+                codes[code] += count
+        return {
+            "levels": dict(levels),
+            "modules": dict(modules),
+            "codes": dict(codes),
+            "messages": self.top_messages(),
+            "lines": self.lines,
+            "invalid": self.invalid
+        }
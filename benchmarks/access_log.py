@@ -0,0 +1,95 @@
+"""Access log parsing throughput of the fast path against apache_log_parser.
+
+Run from the repository root:
+
+    python3 -m benchmarks.access_log --lines 200000
+"""
+import argparse
+import random
+import time
+
+from apache_log import LineParser, LogAggregate
+
+FORMATS = {
+    "common": '%h %l %u %t "%r" %>s %b',
+    "combined": '%h %l %u %t "%r" %>s %O "%{Referer}i" "%{User-Agent}i"',
+    "vhost_combined": '%v:%p %h %l %u %t "%r" %>s %O "%{Referer}i" "%{User-Agent}i"',
+    "timed": '%h %l %u %t "%r" %>s %b %D',
+}
+
+PATHS = ["/", "/index.php", "/wp-login.php", "/static/app.css", "/static/app.js", "/api/v1/items?page=2",
+         "/images/logo.png", "/search?q=brixmond"]
+AGENTS = ["Mozilla/5.0 (X11; Linux x86_64; rv:38.0) Gecko/20100101 Firefox/38.0",
+          "Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/43.0.2357.81",
+          "curl/7.38.0"]
+
+
+def generate_line(logformat, rng):
+    """Render one line for the few directives used in FORMATS."""
+    values = {
+        "%v": "www{}.example.com".format(rng.randint(1, 20)),
+        "%p": "80",
+        "%h": "10.0.{}.{}".format(rng.randint(0, 255), rng.randint(1, 254)),
+        "%l": "-",
+        "%u": "-",
+        "%t": "[18/Oct/2026:12:{:02d}:{:02d} +0200]".format(rng.randint(0, 59), rng.randint(0, 59)),
+        "%r": "{} {} HTTP/1.1".format(rng.choice(["GET", "GET", "POST"]), rng.choice(PATHS)),
+        "%>s": str(rng.choice([200, 200, 200, 200, 301, 304, 404, 500])),
+        "%b": str(rng.randint(0, 100000)),
+        "%O": str(rng.randint(200, 100000)),
+        "%D": str(rng.randint(100, 3000000)),
+        "%{Referer}i": "-",
+        "%{User-Agent}i": rng.choice(AGENTS),
+    }
+    line = logformat
+    for directive in sorted(values, key=len, reverse=True):
+        line = line.replace(directive, values[directive])
+    return line
+
+
+def measure(name, function, lines):
+    start = time.perf_counter()
+    function(lines)
+    elapsed = time.perf_counter() - start
+    print("  {:<20} {:>12,.0f} lines/sec".format(name, len(lines) / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lines", type=int, default=100000)
+    args = parser.parse_args()
+
+    try:
+        import apache_log_parser
+    except ImportError:
+        apache_log_parser = None
+        print("apache_log_parser is not installed, only measuring the fast path")
+
+    rng = random.Random(42)
+    for name, logformat in sorted(FORMATS.items()):
+        lines = [generate_line(logformat, rng) for i in range(args.lines)]
+        print(name)
+        fast = LineParser(logformat)
+
+        def run_fast(lines):
+            aggregate = LogAggregate()
+            for line in lines:
+                aggregate.add("bench", fast(line))
+            assert aggregate.invalid == 0
+
+        measure("fast path", run_fast, lines)
+
+        if apache_log_parser is not None:
+            full = apache_log_parser.make_parser(logformat)
+
+            def run_full(lines):
+                result = {}
+                for line in lines:
+                    status = int(full(line)['status'])
+                    result[status] = result.get(status, 0) + 1
+
+            measure("apache_log_parser", run_full, lines)
+
+
+if __name__ == "__main__":
+    main()
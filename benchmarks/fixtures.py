@@ -0,0 +1,198 @@
+"""Synthetic inputs for the monitors: /proc trees, Apache logs and config,
+Lynis reports and a canned varnishstat.
+"""
+import json
+import os
+import random
+import stat
+
+from benchmarks.access_log import FORMATS, generate_line
+from benchmarks.sockets import write_synthetic
+
+STAT_LINE = "{pid} ({name}) S 1 {pid} {pid} 0 -1 4194560 1000 0 0 0 {utime} {stime} 0 0 20 0 1 0 {start} " \
+            "123456789 {rss} 18446744073709551615 1 1 0 0 0 0 0 4096 0 0 0 0 17 0 0 0 0 0 0\n"
+
+
+def write_proc(root, cpus=8, processes=500, sockets=10000, disks=8, rng=None):
+    """A /proc tree with the files read by the cpu, mem, load, net, diskio and processes monitors.
+
+    The /sys/block entries for the disks are written to root as well.
+    """
+    rng = rng or random.Random(42)
+    write_synthetic(root, sockets)
+
+    with open(os.path.join(root, "stat"), "w") as proc_stat:
+        proc_stat.write("cpu  {}\n".format(" ".join(["1000"] * 10)))
+        for cpu in range(cpus):
+            proc_stat.write("cpu{} {}\n".format(cpu, " ".join(str(rng.randint(1000, 100000)) for i in range(10))))
+        proc_stat.write("intr 123456\nctxt 654321\nbtime 1700000000\nprocesses {}\n".format(processes))
+    with open(os.path.join(root, "meminfo"), "w") as meminfo:
+        for key, value in (("MemTotal", 16318408), ("MemFree", 1203460), ("MemAvailable", 9871244),
+                           ("Buffers", 342100), ("Cached", 7321400), ("SwapCached", 0), ("Active", 8123400),
+                           ("Inactive", 4312300), ("SwapTotal", 2097148), ("SwapFree", 2000000)):
+            meminfo.write("{}: {:>16} kB\n".format(key, value))
+    with open(os.path.join(root, "vmstat"), "w") as vmstat:
+        vmstat.write("nr_free_pages 300865\npswpin 1234\npswpout 5678\npgfault 987654321\n")
+    with open(os.path.join(root, "loadavg"), "w") as loadavg:
+        loadavg.write("0.52 0.58 0.59 2/{} 12345\n".format(processes))
+    with open(os.path.join(root, "net", "dev"), "w") as net_dev:
+        net_dev.write("Inter-|   Receive                                                |  Transmit\n")
+        net_dev.write(" face |bytes    packets errs drop fifo frame compressed multicast|bytes    packets errs "
+                      "drop fifo colls carrier compressed\n")
+        for interface in ("lo", "eth0", "eth1"):
+            net_dev.write("{:>6}: {}\n".format(interface, " ".join(str(rng.randint(0, 10 ** 9)) for i in range(16))))
+
+    with open(os.path.join(root, "diskstats"), "w") as diskstats:
+        for disk in range(disks):
+            name = "sd" + chr(ord("a") + disk % 26) * (disk // 26 + 1)
+            os.makedirs(os.path.join(root, "block", name))
+            for partition in ("", "1", "2"):
+                diskstats.write("   8       {} {}{} {}\n".format(disk * 16, name, partition, " ".join(
+                    str(rng.randint(0, 10 ** 9)) for i in range(17))))
+
+    for pid in range(1, processes + 1):
+        directory = os.path.join(root, str(pid))
+        os.makedirs(directory)
+        with open(os.path.join(directory, "stat"), "w") as pid_stat:
+            pid_stat.write(STAT_LINE.format(pid=pid, name="worker {}".format(pid), utime=rng.randint(0, 100000),
+                                            stime=rng.randint(0, 10000), start=pid * 100,
+                                            rss=rng.randint(100, 100000)))
+        with open(os.path.join(directory, "cmdline"), "w") as cmdline:
+            cmdline.write("/usr/sbin/worker\0--id\0{}\0".format(pid))
+        with open(os.path.join(directory, "io"), "w") as io:
+            io.write("rchar: 1\nwchar: 1\nread_bytes: {}\nwrite_bytes: {}\n".format(rng.randint(0, 10 ** 9),
+                                                                                  rng.randint(0, 10 ** 9)))
+    os.symlink("1", os.path.join(root, "self"))
+
+
+def write_apache(root, vhosts=20, rng=None):
+    """An Apache config tree with one CustomLog per vhost, spread over FORMATS.
+
+    Returns the apache_config layout and the list of (log path, format).
+    """
+    rng = rng or random.Random(42)
+    config = os.path.join(root, "etc")
+    logs = os.path.join(root, "log")
+    os.makedirs(os.path.join(config, "sites-enabled"))
+    os.makedirs(logs)
+    with open(os.path.join(config, "envvars"), "w") as envvars:
+        envvars.write("export APACHE_LOG_DIR={}$SUFFIX\n".format(logs))
+    with open(os.path.join(config, "apache2.conf"), "w") as main:
+        main.write('ServerRoot "{}"\n'.format(config))
+        for name, logformat in sorted(FORMATS.items()):
+            main.write('LogFormat "{}" {}\n'.format(logformat.replace('"', '\\"'), name))
+        main.write("ErrorLog ${APACHE_LOG_DIR}/error.log\n")
+        main.write("IncludeOptional sites-enabled/*.conf\n")
+
+    names = sorted(FORMATS)
+    files = []
+    for vhost in range(vhosts):
+        name = names[vhost % len(names)]
+        path = os.path.join(logs, "vhost{}.log".format(vhost))
+        open(path, "w").close()
+        with open(os.path.join(config, "sites-enabled", "vhost{}.conf".format(vhost)), "w") as site:
+            site.write("<VirtualHost *:80>\n    ServerName www{}.example.com\n".format(vhost))
+            site.write("    CustomLog ${{APACHE_LOG_DIR}}/vhost{}.log {}\n</VirtualHost>\n".format(vhost, name))
+        files.append((path, FORMATS[name]))
+    return [(config, "apache2.conf", os.path.join(config, "envvars"))], files
+
+
+def append_access_logs(files, megabytes, rng=None):
+    """Append about megabytes of lines in total over the logs, returns the line count.
+
+    A block of generated lines is written repeatedly, generating every line
+    would take longer than parsing them.
+    """
+    rng = rng or random.Random(42)
+    per_file = megabytes * 1024 * 1024 // len(files)
+    lines = 0
+    for path, logformat in files:
+        block = [generate_line(logformat, rng) for i in range(1000)]
+        data = ("\n".join(block) + "\n").encode()
+        repeat = max(1, per_file // len(data))
+        with open(path, "ab") as log:
+            for i in range(repeat):
+                log.write(data)
+        lines += repeat * len(block)
+    return lines
+
+
+ERROR_LINES = [
+    "[{time}] [proxy:error] [pid {pid}:tid {tid}] (111)Connection refused: AH00957: HTTP: attempt to connect to "
+    "127.0.0.1:{port} (localhost) failed",
+    "[{time}] [proxy_http:error] [pid {pid}:tid {tid}] (70007)The timeout specified has expired: [client "
+    "10.0.{n}.1:{port}] AH01102: error reading status line from remote server localhost:8080, referer: http://x/",
+    "[{time}] [php7:error] [pid {pid}:tid {tid}] [client 10.0.{n}.1:{port}] PHP Warning:  Undefined index {n} in "
+    "/var/www/site{n}/index.php on line {port}",
+    "[{time}] [core:crit] [pid {pid}:tid {tid}] AH00102: [{time}] file mpm_common.c, line {n}",
+    "[{time}] [authz_core:error] [pid {pid}:tid {tid}] [client 10.0.{n}.1:{port}] AH01630: client denied by server "
+    "configuration: /var/www/private/u{unique:x}",
+    "Stack trace:",
+]
+
+
+def append_error_log(path, lines, rng=None):
+    """Append an error storm of lines to path, mostly repeats with a sixth of distinct messages."""
+    rng = rng or random.Random(42)
+    with open(path, "a") as log:
+        for i in range(lines):
+            log.write(rng.choice(ERROR_LINES).format(time="Sat Oct 18 12:00:00.123456 2026", pid=rng.randint(1, 9999),
+                                                     tid=rng.randint(1, 10 ** 9), port=rng.randint(1024, 65535),
+                                                     n=rng.randint(0, 255), unique=i) + "\n")
+    return lines
+
+
+def write_lynis_report(path, entries=5000, old_format=False, rng=None):
+    """A lynis-report.dat with entries warnings and suggestions among the usual noise."""
+    rng = rng or random.Random(42)
+    with open(path, "w") as report:
+        if old_format:
+            report.write("[General]\n")
+        report.write("# Lynis Report\nreport_version_major=1\nauditor=Brixmond\n")
+        for i in range(entries):
+            test = "TEST-{:04d}".format(i)
+            report.write("installed_package[]={}-1.0\n".format(test.lower()))
+            report.write("test_executed[]={}\n".format(test))
+            kind = "warning" if rng.random() < 0.2 else "suggestion"
+            if old_format:
+                report.write("{}[]={}|{}|Description of finding {}|-|\n".format(kind, test, rng.choice("LMH"), i))
+            else:
+                report.write("{}[]={}|Description of finding {}|-|-|\n".format(kind, test, i))
+
+
+VARNISHSTAT = """#!/bin/sh
+if [ "$1" = "-V" ]; then
+    echo "varnishstat (varnish-6.6.2 revision 0000000)" >&2
+    exit 0
+fi
+cat "{}"
+"""
+
+
+def write_varnishstat(directory, backends=50, extra=400, rng=None):
+    """A varnishstat script printing a canned -j dump, returns the directory to put on PATH."""
+    rng = rng or random.Random(42)
+    counters = {}
+    for name in ("cache_hit", "cache_miss", "sess_conn", "sess_drop", "n_lru_nuked", "backend_fail",
+                 "backend_unhealthy", "threads_failed"):
+        counters["MAIN." + name] = {"description": name, "flag": "c", "format": "i",
+                                    "value": rng.randint(0, 10 ** 9)}
+    counters["MAIN.threads"] = {"description": "threads", "flag": "g", "format": "i", "value": 200}
+    for backend in range(backends):
+        counters["VBE.boot.backend{}.happy".format(backend)] = {"description": "Happy health probes", "flag": "b",
+                                                               "format": "b", "value": 2 ** 64 - 1}
+        counters["VBE.boot.backend{}.bereq_hdrbytes".format(backend)] = {"description": "Request header bytes",
+                                                                        "flag": "c", "format": "B",
+                                                                        "value": rng.randint(0, 10 ** 9)}
+    for i in range(extra):
+        counters["MAIN.counter{}".format(i)] = {"description": "filler", "flag": "c", "format": "i",
+                                                "value": rng.randint(0, 10 ** 9)}
+
+    dump = os.path.join(directory, "varnishstat.json")
+    with open(dump, "w") as output:
+        json.dump({"version": 1, "timestamp": "2026-10-18T12:00:00", "counters": counters}, output)
+    script = os.path.join(directory, "varnishstat")
+    with open(script, "w") as output:
+        output.write(VARNISHSTAT.format(dump))
+    os.chmod(script, os.stat(script).st_mode | stat.S_IXUSR)
+    return directory
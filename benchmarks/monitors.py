@@ -0,0 +1,165 @@
+"""Cost of one collection for every monitor, run against synthetic fixtures.
+
+Run from the repository root:
+
+    python3 -m benchmarks.monitors
+    python3 -m benchmarks.monitors --log-mb 2048 --workers 4 apache
+
+Every case runs in a forked process so the peak RSS belongs to that monitor
+alone. CPU time includes child processes like varnishstat, but not the
+Apache log workers which keep running, compare wall time for those.
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+from benchmarks import fixtures
+
+
+def cpu_time():
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def peak_rss():
+    # ru_maxrss is in KiB on Linux
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * 1024
+
+
+def measure(collect, repeat, prepare=None):
+    """Time repeat collections, prepare() runs before each and returns the lines it added."""
+    wall = cpu = 0.0
+    lines = 0
+    for i in range(repeat):
+        if prepare is not None:
+            lines += prepare()
+        start, cpu_start = time.perf_counter(), cpu_time()
+        collect()
+        wall += time.perf_counter() - start
+        cpu += cpu_time() - cpu_start
+    return {"wall": wall / repeat, "cpu": cpu / repeat, "lines": lines, "elapsed": wall}
+
+
+def case_proc(name, args, root):
+    import procsnap
+    from monitors_base import MonitorCPU, MonitorMem, MonitorLoad, MonitorNetwork, MonitorDiskIO
+    from monitors_info import MonitorProcesses
+
+    # max_age=0 so every collection reads /proc again
+    snapshot = procsnap.SystemSnapshot(root, max_age=0)
+    monitor = {
+        "cpu": lambda: MonitorCPU(snapshot),
+        "mem": lambda: MonitorMem(snapshot),
+        "load": lambda: MonitorLoad(snapshot),
+        "net": lambda: MonitorNetwork(snapshot, proc_root=root),
+        "diskio": lambda: MonitorDiskIO(proc_root=root, sys_root=root),
+        "processes": lambda: MonitorProcesses(count=5, sort="cpu,io", proc_root=root),
+    }[name]()
+    return measure(monitor.collect, args.repeat)
+
+
+def case_apache(args, root):
+    from apache_config import ApacheConfig
+    from monitors_webserver import MonitorApache
+
+    layouts, files = fixtures.write_apache(root, vhosts=args.vhosts)
+    monitor = MonitorApache(vhosts=True, ingest="poll", workers=args.workers, discovery_interval=10 ** 9,
+                            config=ApacheConfig(layouts))
+    megabytes = max(1, args.log_mb // args.repeat)
+    return measure(monitor.collect, args.repeat, lambda: fixtures.append_access_logs(files, megabytes))
+
+
+def case_apache_errors(args, root):
+    from apache_config import ApacheConfig
+    from monitors_webserver import MonitorApacheErrors
+
+    layouts, files = fixtures.write_apache(root, vhosts=1)
+    path = os.path.join(root, "log", "error.log")
+    open(path, "w").close()
+    monitor = MonitorApacheErrors(ingest="poll", discovery_interval=10 ** 9, config=ApacheConfig(layouts))
+    lines = max(1, args.error_lines // args.repeat)
+    return measure(monitor.collect, args.repeat, lambda: fixtures.append_error_log(path, lines))
+
+
+def case_lynis(args, root, cached):
+    from monitor_lynis import Lynis
+
+    path = os.path.join(root, "lynis-report.dat")
+    fixtures.write_lynis_report(path, entries=args.lynis_entries)
+    lynis = Lynis(report_path=path)
+    if cached:
+        lynis.get_report()
+        return measure(lynis.get_report, args.repeat)
+
+    def touch():
+        # A new mtime makes the next call parse the report again
+        stamp = int(time.time() * 10 ** 9)
+        os.utime(path, ns=(stamp, stamp))
+        return 0
+    return measure(lynis.get_report, args.repeat, touch)
+
+
+def case_varnish(args, root):
+    os.environ["PATH"] = fixtures.write_varnishstat(root) + os.pathsep + os.environ["PATH"]
+    from monitors_webserver import MonitorVarnish
+
+    monitor = MonitorVarnish(counters=["MAIN.n_lru_nuked", "MAIN.threads", "VBE.*.happy"])
+    return measure(monitor.collect, args.repeat)
+
+
+def run_case(name, args, connection):
+    with tempfile.TemporaryDirectory() as root:
+        if name in ("cpu", "mem", "load", "net", "diskio", "processes"):
+            fixtures.write_proc(root, cpus=args.cpus, processes=args.processes, sockets=args.sockets,
+                                disks=args.disks)
+            result = case_proc(name, args, root)
+        elif name == "apache":
+            result = case_apache(args, root)
+        elif name == "apache-errors":
+            result = case_apache_errors(args, root)
+        elif name in ("lynis", "lynis-cached"):
+            result = case_lynis(args, root, name == "lynis-cached")
+        else:
+            result = case_varnish(args, root)
+    result["rss"] = peak_rss()
+    connection.send(result)
+
+
+CASES = ["cpu", "mem", "load", "net", "diskio", "processes", "apache", "apache-errors", "lynis", "lynis-cached",
+         "varnish"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("cases", nargs="*", default=CASES, help="Any of " + ", ".join(CASES))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--cpus", type=int, default=32, help="CPUs in the fake /proc/stat")
+    parser.add_argument("--processes", type=int, default=2000, help="Processes in the fake /proc")
+    parser.add_argument("--sockets", type=int, default=50000, help="Sockets in the fake /proc/net/tcp")
+    parser.add_argument("--disks", type=int, default=24, help="Disks in the fake /proc/diskstats")
+    parser.add_argument("--vhosts", type=int, default=50, help="Access logs in the fake Apache config")
+    parser.add_argument("--log-mb", type=int, default=256, help="Access log data appended over all collections")
+    parser.add_argument("--workers", type=int, default=0, help="Apache log worker processes")
+    parser.add_argument("--error-lines", type=int, default=500000, help="Error log lines appended over all collections")
+    parser.add_argument("--lynis-entries", type=int, default=20000)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("fork")
+    print("{:<14} {:>10} {:>10} {:>10} {:>14}".format("monitor", "wall ms", "cpu ms", "rss MiB", "lines/sec"))
+    for name in args.cases:
+        parent, child = context.Pipe()
+        process = context.Process(target=run_case, args=(name, args, child))
+        process.start()
+        result = parent.recv()
+        process.join()
+        rate = "{:,.0f}".format(result["lines"] / result["elapsed"]) if result["lines"] else "-"
+        print("{:<14} {:>10.1f} {:>10.1f} {:>10.1f} {:>14}".format(name, result["wall"] * 1000, result["cpu"] * 1000,
+                                                                  result["rss"] / 1024 / 1024, rate))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""A local stand-in for the Brixmond server that records uploaded packets.
+
+Run from the repository root to point a real brixmond at it:
+
+    python3 -m benchmarks.server --port 8080 --latency 0.2 --failures 0.1
+"""
+import argparse
+import gzip
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeServer(object):
+    """Serves /client/config and records /client/packet uploads.
+
+    Every request is delayed by latency seconds and a failure_rate fraction of
+    the uploads is answered with a 503.
+    """
+
+    def __init__(self, address="127.0.0.1", port=0, latency=0.0, failure_rate=0.0, config=None, seed=42):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.config = {
+            "enabled": True,
+            "polling_time": 1,
+            "send_throttle": 60,
+            "monitor_enabled": {"apache": True},
+            "packet_encoding": "columnar",
+            "packet_compression": "gzip",
+            "info_unchanged": True
+        }
+        self.config.update(config or {})
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"packets": 0, "failed": 0, "bytes": 0, "entries": 0}
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                server.handle_config(self)
+
+            def do_POST(self):
+                server.handle_packet(self)
+
+        self.httpd = ThreadingHTTPServer((address, port), Handler)
+        self.address = "{}:{}".format(*self.httpd.server_address)
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, name="fakeserver", daemon=True).start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def reply(self, request, status, body=b""):
+        request.send_response(status)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def handle_config(self, request):
+        time.sleep(self.latency)
+        if not request.path.startswith("/client/config/"):
+            self.reply(request, 404)
+            return
+        self.reply(request, 200, json.dumps(self.config).encode())
+
+    def handle_packet(self, request):
+        body = request.rfile.read(int(request.headers.get("Content-Length", 0)))
+        time.sleep(self.latency)
+        with self.lock:
+            if self.rng.random() < self.failure_rate:
+                self.stats["failed"] += 1
+                self.reply(request, 503)
+                return
+        encoding = request.headers.get("Content-Encoding")
+        data = gzip.decompress(body) if encoding == "gzip" else body
+        if encoding == "zstd":
+            import zstandard
+            data = zstandard.ZstdDecompressor().decompress(body)
+        packet = json.loads(data.decode("UTF-8"))
+        with self.lock:
+            self.stats["packets"] += 1
+            self.stats["bytes"] += len(body)
+            self.stats["entries"] += len(packet["entries"]) if isinstance(packet, dict) else len(packet)
+        self.reply(request, 200, b"{}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--address", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every request")
+    parser.add_argument("--failures", type=float, default=0.0, help="Fraction of uploads answered with a 503")
+    args = parser.parse_args()
+
+    server = FakeServer(args.address, args.port, args.latency, args.failures)
+    print("Listening on {}".format(server.address))
+    server.start()
+    try:
+        while True:
+            time.sleep(10)
+            print(server.stats)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
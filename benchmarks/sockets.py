@@ -0,0 +1,90 @@
+"""Compare socket state counting through /proc/net with psutil.net_connections().
+
+Run from the repository root:
+
+    python3 -m benchmarks.sockets --synthetic 200000
+    python3 -m benchmarks.sockets --sockets 5000
+
+--synthetic writes a fake /proc/net tree with that many TIME_WAIT and
+ESTABLISHED entries and times the /proc parser on it. --sockets opens that
+many real loopback connections and times both collectors on the live system.
+"""
+import argparse
+import os
+import socket
+import tempfile
+import time
+import tracemalloc
+
+import procnet
+
+TCP_LINE = "{:6d}: 0100007F:{:04X} 0100007F:1F90 {} 00000000:00000000 00:00000000 00000000  1000        0 0 1 " \
+           "0000000000000000 20 4 30 10 -1\n"
+
+
+def write_synthetic(root, count):
+    os.makedirs(os.path.join(root, "net"))
+    with open(os.path.join(root, "net", "tcp"), "w") as table:
+        table.write("  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout "
+                    "inode\n")
+        for i in range(count):
+            table.write(TCP_LINE.format(i, i % 65536, "06" if i % 4 else "01"))
+    for name in ("tcp6", "udp", "udp6"):
+        with open(os.path.join(root, "net", name), "w") as table:
+            table.write("header\n")
+
+
+def measure(name, function, repeat):
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    for i in range(repeat):
+        result = function()
+    wall = (time.perf_counter() - start) / repeat
+    cpu = (time.process_time() - cpu_start) / repeat
+    # Separate run, tracing allocations slows the collectors down a lot
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print("{:<24} {:>10.1f} ms wall {:>10.1f} ms cpu {:>10.1f} KiB peak".format(name, wall * 1000, cpu * 1000,
+                                                                                 peak / 1024))
+    return result
+
+
+def open_connections(count):
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(1024)
+    sockets = [server]
+    for i in range(count):
+        client = socket.create_connection(server.getsockname())
+        accepted, address = server.accept()
+        sockets += [client, accepted]
+    return sockets
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--synthetic", type=int, default=0, help="Entries in a synthetic /proc/net/tcp")
+    parser.add_argument("--sockets", type=int, default=0, help="Real loopback connections to open")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        with tempfile.TemporaryDirectory() as root:
+            write_synthetic(root, args.synthetic)
+            print("Synthetic table with {} sockets".format(args.synthetic))
+            measure("procnet", lambda: procnet.count_socket_states(root), args.repeat)
+
+    if args.sockets:
+        from monitors_base import MonitorNetwork
+        sockets = open_connections(args.sockets)
+        print("Live system with {} extra loopback connections".format(args.sockets))
+        measure("procnet", procnet.count_socket_states, args.repeat)
+        measure("psutil.net_connections", MonitorNetwork.count_psutil_connections, args.repeat)
+        for sock in sockets:
+            sock.close()
+
+
+if __name__ == "__main__":
+    main()
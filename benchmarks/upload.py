@@ -0,0 +1,98 @@
+"""Upload cost of the sender against a local fake server with latency and failures.
+
+Run from the repository root:
+
+    python3 -m benchmarks.upload --packets 200 --latency 0.05 --failures 0.2
+
+Every encoding and compression combination sends the same packets. The
+report lists the bytes that reached the server, the CPU time spent in
+brixmond and how long it took to deliver everything including retries.
+"""
+import argparse
+import logging
+import os
+import random
+import tempfile
+import time
+
+import wire
+from benchmarks.server import FakeServer
+from configuration import Configuration
+from monitor import Monitor, make_result
+from sender import Sender
+from spool import Spool, Backoff
+from transport import Transport
+
+
+def generate_packets(count, size, rng):
+    monitors = []
+    for name in ("cpu", "mem", "load", "net", "apache", "processes"):
+        monitor = Monitor()
+        monitor.name = name
+        monitors.append(monitor)
+    stamp = time.time()
+    packets = []
+    for i in range(count):
+        packet = []
+        for j in range(size):
+            monitor = monitors[j % len(monitors)]
+            point = {"value{}".format(k): round(rng.random() * 100, 1) for k in range(8)}
+            packet.append(make_result(monitor, point, stamp))
+            stamp += 1
+        packets.append(packet)
+    return packets
+
+
+def run(packets, encoding, compression, args, logger, directory):
+    server = FakeServer(latency=args.latency, failure_rate=args.failures)
+    server.start()
+    transport = Transport(server.address, "bench.example.com", "secret", logger)
+    config = Configuration(transport, logger)
+    config.packet_encoding = encoding
+    config.packet_compression = compression
+    config.send_throttle = 0.1
+    config.ready.set()
+
+    # The sender thread can't be stopped, every run gets its own spool
+    spool = Spool(os.path.join(directory, "{}-{}.db".format(encoding, compression)))
+    sender = Sender(transport, config, spool, logger)
+    sender.backoff = Backoff(initial=0.05, maximum=0.5)
+    start, cpu_start = time.perf_counter(), time.process_time()
+    sender.start()
+    for packet in packets:
+        sender.outbox.put(packet)
+    while server.stats["entries"] < sum(len(packet) for packet in packets):
+        time.sleep(0.01)
+    wall = time.perf_counter() - start
+    # Includes the fake server threads, which only decode and count
+    cpu = time.process_time() - cpu_start
+    server.stop()
+
+    print("{:<10} {:<6} {:>12,} {:>8} {:>8} {:>10.0f} {:>10.2f}".format(
+        encoding, compression or "-", server.stats["bytes"], server.stats["packets"], server.stats["failed"],
+        cpu * 1000, wall))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--packets", type=int, default=100)
+    parser.add_argument("--size", type=int, default=500, help="Results per packet")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every request")
+    parser.add_argument("--failures", type=float, default=0.0, help="Fraction of uploads answered with a 503")
+    args = parser.parse_args()
+
+    logger = logging.getLogger("brixmond")
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    packets = generate_packets(args.packets, args.size, random.Random(42))
+
+    print("{:<10} {:<6} {:>12} {:>8} {:>8} {:>10} {:>10}".format("encoding", "comp", "bytes", "packets", "failed",
+                                                                 "cpu ms", "wall s"))
+    with tempfile.TemporaryDirectory() as directory:
+        for encoding in wire.ENCODINGS:
+            for compression in [None] + wire.COMPRESSIONS:
+                run(packets, encoding, compression, args, logger, directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,18 +6,40 @@ import logging.handlers
 import argparse
 import os
 import configparser
+import importlib
+import threading
 import uuid
-import queue
-from time import sleep
-import requests
-import requests.exceptions
+import zlib
 
 from configuration import Configuration
-from monitor import MonitorThread
-from monitors_base import MonitorCPU, MonitorMem, MonitorLoad, MonitorNetwork
-from monitors_info import MonitorProcesses, MonitorIP, MonitorDisks
-from monitor_lynis import MonitorLynis, Lynis
-from monitors_webserver import MonitorApache, MonitorVarnish
+from monitor import make_result, ChangeFilter
+from scheduler import Scheduler
+from resultqueue import ResultQueue
+from rollup import Rollup
+from exporter import Exporter
+from spool import Spool
+from transport import Transport
+from sender import Sender
+import wire
+
+# name, module, class and the class with an installed() check. Modules are
+# only imported for enabled monitors.
+MONITORS = [
+    ("brixmond", "monitors_self", "MonitorBrixmond", None),
+    ("cpu", "monitors_base", "MonitorCPU", None),
+    ("mem", "monitors_base", "MonitorMem", None),
+    ("disks", "monitors_info", "MonitorDisks", None),
+    ("diskio", "monitors_base", "MonitorDiskIO", None),
+    ("cgroups", "monitors_cgroup", "MonitorCgroups", "MonitorCgroups"),
+    ("load", "monitors_base", "MonitorLoad", None),
+    ("net", "monitors_base", "MonitorNetwork", None),
+    ("ip", "monitors_info", "MonitorIP", None),
+    ("processes", "monitors_info", "MonitorProcesses", None),
+    ("lynis", "monitor_lynis", "MonitorLynis", "Lynis"),
+    ("varnish", "monitors_webserver", "MonitorVarnish", "MonitorVarnish"),
+    ("apache", "monitors_webserver", "MonitorApache", "MonitorApache"),
+    ("apache_errors", "monitors_webserver", "MonitorApacheErrors", "MonitorApache"),
+]
 
 
 logger = logging.getLogger('brixmond')
@@ -26,6 +48,7 @@ logger.setLevel(logging.DEBUG)
 parser = argparse.ArgumentParser(description="BrixIT Monitoring daemon")
 parser.add_argument("-d", "--daemon", help="Start in daemon mode", action="store_true")
 parser.add_argument("server", help="The address to reach te monitoring server")
+parser.add_argument("-s", "--https", help="Connect to the server over HTTPS", action="store_true")
 parser.add_argument("-f", "--fqdn", help="Override the FQDN reported to the server", default=os.uname()[1])
 parser.add_argument("-c", "--configfile", help="Override the config file to use (/etc/brixmond.conf)",
                     default="/etc/brixmond.conf")
@@ -47,79 +70,249 @@ else:
 logger.info("Starting brixmond")
 logger.info("Server identifier: {}".format(args.fqdn))
 
-config = configparser.ConfigParser()
-config.read(args.configfile)
-sections = config.sections()
-if not config.has_section("global"):
-    config.add_section("global")
+local_config = configparser.ConfigParser()
+local_config.read(args.configfile)
+if not local_config.has_section("global"):
+    local_config.add_section("global")
 
-secret = config.get("global", "secret", fallback=None)
+secret = local_config.get("global", "secret", fallback=None)
 
 if secret is None:
     logger.warn("No secret is found. generating new secret")
     secret = str(uuid.uuid4())
-    config.set("global", "secret", secret)
+    local_config.set("global", "secret", secret)
     logger.info("New secret: {}".format(secret))
     with open(args.configfile, "w") as configfile:
-        config.write(configfile)
+        local_config.write(configfile)
 
 logger.info("Connecting to {} to get configuration and update system info".format(args.server))
 
-config = Configuration(args.server, args.fqdn, secret, logger)
-config.fetch()
+verify = local_config.get("global", "verify_tls", fallback="yes")
+transport = Transport(args.server, args.fqdn, secret, logger,
+                      https=args.https or local_config.getboolean("global", "https", fallback=False),
+                      verify=verify if os.path.exists(verify) else verify.lower() not in ("no", "false", "0"),
+                      connect_timeout=local_config.getint("global", "connect_timeout", fallback=5),
+                      read_timeout=local_config.getint("global", "read_timeout", fallback=30))
+
+config = Configuration(transport, logger,
+                       sysinfo_cache=local_config.get("global", "sysinfo_cache",
+                                                      fallback="/var/lib/brixmond/sysinfo.json"),
+                       refresh_interval=local_config.getint("global", "config_refresh", fallback=5) * 60)
 
 logger.info("Creating result queue")
 
-result_queue = queue.Queue()
+result_queue = ResultQueue(max_items=local_config.getint("global", "queue_max_items", fallback=10000),
+                           max_bytes=local_config.getint("global", "queue_max_mb", fallback=16) * 1024 * 1024)
+
+rollup_monitors = [name.strip() for name in local_config.get("rollup", "monitors", fallback="").split(",")
+                   if name.strip()]
+rollup_resolution = local_config.getint("rollup", "resolution", fallback=5)
+rollup = Rollup(rollup_monitors, window=config.send_throttle,
+                raw_seconds=local_config.getint("rollup", "raw_minutes", fallback=10) * 60)
+if rollup_monitors:
+    logger.info("Rolling up {} every {} seconds".format(", ".join(rollup_monitors), config.send_throttle))
+
+
+change_filter = ChangeFilter(keyframe=local_config.getint("global", "keyframe", fallback=60) * 60)
+change_filter.enabled = config.info_unchanged
+result_queue.drop_listeners.append(change_filter.forget)
+
+
+exporter = None
+if local_config.has_option("exporter", "listen"):
+    address, port = local_config.get("exporter", "listen").rsplit(":", 1)
+    try:
+        exporter = Exporter(address.strip("[]"), int(port), logger, rollup=rollup)
+    except OSError as e:
+        logger.error("Cannot serve metrics on {}, running without the exporter: {}".format(
+            local_config.get("exporter", "listen"), e))
+    else:
+        exporter.start()
+        logger.info("Serving metrics on http://{}/metrics".format(local_config.get("exporter", "listen")))
+
+
+def emit(monitor, point, stamp):
+    if exporter is not None:
+        exporter.update(monitor, point, stamp)
+    if not rollup.offer(monitor, point, stamp):
+        result_queue.put(change_filter.filter(monitor, make_result(monitor, point, stamp)))
+
+
+logger.info("Starting scheduler")
+
+scheduler = Scheduler(emit=emit,
+                      workers=local_config.getint("global", "workers", fallback=2),
+                      logger=logger)
+scheduler.start()
+
+
+running = {}
+running_lock = threading.Lock()
+default_intervals = {}
+# Monitors disabled in the local config or not installed, never probed again
+skipped = set()
+# Shared by the apache and apache_errors monitors so the config is walked once
+apache_config = None
+
 
-logger.info("Starting threads")
+def monitor_interval(name):
+    """An interval in the local config wins over the server, which wins over the monitor default.
 
-monitors = []
+    Rolled up monitors always sample every rollup resolution seconds, the
+    rollup series are sized for it.
+    """
+    if name in rollup_monitors:
+        return rollup_resolution
+    if local_config.has_option(name, "interval"):
+        return local_config.getint(name, "interval")
+    if config.monitor_interval.get(name):
+        return int(config.monitor_interval[name])
+    return default_intervals[name]
 
 
 def start_monitor(monitor):
-    monitor_thread = MonitorThread(monitor=monitor, queue=result_queue)
-    monitors.append(monitor_thread)
-    monitor_thread.start()
-
-# start all base monitors
-start_monitor(MonitorCPU())
-start_monitor(MonitorMem())
-start_monitor(MonitorDisks())
-start_monitor(MonitorLoad())
-start_monitor(MonitorNetwork())
-start_monitor(MonitorIP())
-start_monitor(MonitorProcesses())
-if Lynis.installed():
-    logger.info("Starting Lynis monitor")
-    start_monitor(MonitorLynis())
-
-if MonitorVarnish.installed():
-    logger.info("Starting Varnish monitor")
-    start_monitor(MonitorVarnish())
-
-# TODO: Add enable/disable monitor in config
-if True:
+    default_intervals[monitor.name] = monitor.interval
+    monitor.interval = monitor_interval(monitor.name)
+    monitor.timeout = local_config.getint(monitor.name, "timeout", fallback=monitor.timeout)
+    if local_config.has_option(monitor.name, "drop_policy"):
+        result_queue.policies[monitor.name] = local_config.get(monitor.name, "drop_policy")
+    running[monitor.name] = monitor
+    scheduler.add(monitor)
+
+
+def stop_monitor(name):
+    running.pop(name)
+    # A collect still running finishes before the monitor is closed
+    scheduler.remove(name, close=True)
+    if exporter is not None:
+        exporter.remove(name)
+
+
+def shared_apache_config():
+    global apache_config
+    if apache_config is None:
+        from apache_config import ApacheConfig
+        apache_config = ApacheConfig()
+    return apache_config
+
+
+def monitor_arguments(name):
+    if name == "brixmond":
+        return {"result_queue": result_queue, "transport": transport}
+    if name == "disks":
+        return {"stat_timeout": local_config.getint("disks", "stat_timeout", fallback=5)}
+    if name == "cgroups":
+        return {"depth": local_config.getint("cgroups", "depth", fallback=2),
+                "rescan": local_config.getint("cgroups", "rescan_interval", fallback=60)}
+    if name == "processes":
+        return {"count": local_config.getint("processes", "count", fallback=5),
+                "sort": local_config.get("processes", "sort", fallback="cpu")}
+    if name == "lynis":
+        return {"audit_interval": local_config.getint("lynis", "audit_interval", fallback=60) * 60,
+                "audit_timeout": local_config.getint("lynis", "audit_timeout", fallback=30) * 60,
+                "cpu_limit": local_config.getint("lynis", "cpu_limit", fallback=10) * 60,
+                "logger": logger}
+    if name == "varnish":
+        counters = local_config.get("varnish", "counters", fallback=None)
+        return {"counters": [counter.strip() for counter in counters.split(",")] if counters else None,
+                "logger": logger}
+    if name == "apache":
+        return {"vhosts": local_config.getboolean("apache", "vhosts", fallback=False),
+                "ingest": local_config.get("apache", "ingest", fallback="inotify"),
+                "workers": local_config.getint("apache", "workers", fallback=0),
+                "discovery_interval": local_config.getint("apache", "discovery_interval", fallback=5) * 60,
+                "config": shared_apache_config(),
+                "logger": logger}
+    if name == "apache_errors":
+        return {"ingest": local_config.get("apache", "ingest", fallback="inotify"),
+                "top": local_config.getint("apache_errors", "top", fallback=10),
+                "max_messages": local_config.getint("apache_errors", "max_messages", fallback=1000),
+                "discovery_interval": local_config.getint("apache", "discovery_interval", fallback=5) * 60,
+                "config": shared_apache_config(),
+                "logger": logger}
+    return {}
+
+
+def load_monitor(name, module_name, class_name, check):
+    """Import and create a monitor, returns None when it is disabled or not installed."""
+    if not local_config.getboolean(name, "enabled", fallback=True):
+        logger.info("The {} monitor is disabled".format(name))
+        skipped.add(name)
+        return None
     try:
-        from monitors_webserver import MonitorApache
-        logger.info("Starting Apache monitor")
-        start_monitor(MonitorApache())
+        module = importlib.import_module(module_name)
+        if check is not None and not getattr(module, check).installed():
+            skipped.add(name)
+            return None
+        logger.info("Starting {} monitor".format(name))
+        return getattr(module, class_name)(**monitor_arguments(name))
     except Exception:
-        logger.error("Cannot load Apache monitor. Python 3.3 required.")
+        logger.exception("Cannot load the {} monitor".format(name))
+        return None
 
-logger.info("Sending data packets every {} seconds".format(config.send_throttle))
+
+def apply_server_config(config):
+    """Start, stop and retune monitors to match the monitor_enabled and monitor_interval sent by the server."""
+    with running_lock:
+        for name, module_name, class_name, check in MONITORS:
+            enabled = bool(config.monitor_enabled.get(name, True))
+            if name in skipped:
+                continue
+            if name not in running and enabled:
+                monitor = load_monitor(name, module_name, class_name, check)
+                if monitor is not None:
+                    start_monitor(monitor)
+            elif name in running and not enabled:
+                logger.info("Stopping {} monitor, it is disabled on the server".format(name))
+                stop_monitor(name)
+            elif name in running:
+                scheduler.set_interval(name, monitor_interval(name))
+
+
+with running_lock:
+    for name, module_name, class_name, check in MONITORS:
+        monitor = load_monitor(name, module_name, class_name, check)
+        if monitor is not None:
+            start_monitor(monitor)
+
+# Collecting has started, packets are spooled until the server answered
+config.listeners.append(apply_server_config)
+config.start()
+
+spool_path = local_config.get("global", "spool", fallback="/var/lib/brixmond/spool.db")
+logger.info("Spooling undelivered packets to {}".format(spool_path))
+spool = Spool(spool_path,
+              max_bytes=local_config.getint("global", "spool_max_mb", fallback=50) * 1024 * 1024,
+              max_age=local_config.getint("global", "spool_max_age", fallback=24 * 7) * 60 * 60)
+# Spooled packets don't say which monitors they hold, start over with full results
+spool.discard_listeners.append(change_filter.forget)
+
+sender = Sender(transport, config, spool, logger)
+sender.start()
+
+# Spread the uploads of a fleet over the send_throttle window, the same host
+# always gets the same phase
+batch = wire.Batch(max_age=config.send_throttle,
+                   max_items=local_config.getint("global", "batch_max_items", fallback=1000),
+                   max_bytes=local_config.getint("global", "batch_max_kb", fallback=256) * 1024,
+                   phase=zlib.crc32(args.fqdn.encode('UTF-8')) / 2 ** 32)
+logger.info("Sending data packets every {} seconds or every {} results".format(config.send_throttle,
+                                                                             batch.max_items))
 
 while True:
-    packet = []
-    while not result_queue.empty():
-        packet.append(result_queue.get())
-    if len(packet) > 0:
-        logger.debug("Sending {} packets to the server".format(len(packet)))
-        try:
-            response = requests.post("http://{}/client/packet/{}/{}".format(args.server, args.fqdn, secret),
-                                     json=packet)
-            logger.debug("Server response: {}".format(response.status_code))
-        except requests.exceptions.ConnectionError as e:
-            logger.error("Cannot connect to the server at http://{}".format(args.server))
-
-    sleep(config.send_throttle)
\ No newline at end of file
+    # The server config arrives in the background and may change these
+    batch.max_age = config.send_throttle
+    rollup.window = config.send_throttle
+    change_filter.enabled = config.info_unchanged
+    for entry in rollup.flush():
+        result_queue.put(entry)
+    timeout = min(batch.time_left(), rollup.time_left()) if rollup_monitors else batch.time_left()
+    for entry in result_queue.get_batch(batch.max_items - len(batch), timeout=timeout):
+        batch.add(entry)
+
+    if batch.ready():
+        drops = result_queue.drop_report()
+        if drops is not None:
+            logger.warning("Result queue overflowed, dropped {}".format(drops["point"]))
+            batch.add(drops)
+        sender.submit(batch.take())
@@ -1,49 +1,184 @@
-import requests
 import requests.exceptions
 import platform
-from cpuinfo import cpuinfo
+import threading
+import json
+import os
 from time import sleep
+from spool import Backoff
+import wire
+
+
+def linux_distribution():
+    """(name, version, codename) of the distribution, platform.linux_distribution() was removed in Python 3.8."""
+    if hasattr(platform, "linux_distribution"):
+        return platform.linux_distribution()
+    release = {}
+    for path in ("/etc/os-release", "/usr/lib/os-release"):
+        try:
+            with open(path) as os_release:
+                for line in os_release:
+                    if "=" in line:
+                        key, value = line.rstrip("\n").split("=", 1)
+                        release[key] = value.strip("\"'")
+            break
+        except (IOError, OSError):
+            continue
+    return release.get("NAME", ""), release.get("VERSION_ID", ""), release.get("VERSION_CODENAME", "")
 
 
 class Configuration(object):
-    def __init__(self, server, fqdn, secret, logger):
-        self.secret = secret
-        self.fqdn = fqdn
-        self.server = server
+    def __init__(self, transport, logger, sysinfo_cache=None, refresh_interval=300):
+        self.transport = transport
         self.logger = logger
+        self.sysinfo_cache = sysinfo_cache
+        self.refresh_interval = refresh_interval
+        self.ready = threading.Event()
+        self.listeners = []
+        self.sysinfo = None
+        self.etag = None
+        self.server_config = None
         self.send_throttle = 120
 
         self.monitor_enabled = {
             "apache": False
         }
+        self.monitor_interval = {}
+        self.packet_encoding = "json"
+        self.packet_compression = None
+        self.info_unchanged = False
 
-    def fetch(self):
-        configpath = "http://{}/client/config/{}/{}".format(self.server, self.fqdn, self.secret)
-        self.logger.debug("Fetching {}".format(configpath))
+    def read_sysinfo(self):
+        """Static system info, cached on disk because cpuinfo is slow and may spawn processes."""
+        if self.sysinfo_cache is not None:
+            try:
+                with open(self.sysinfo_cache) as cache:
+                    sysinfo = json.load(cache)
+                # A resized VM or a migrated disk gets its info read again
+                if sysinfo.get("arch") == platform.machine() and sysinfo.get("cores") == os.cpu_count():
+                    return sysinfo
+            except (IOError, OSError, ValueError):
+                pass
+
+        from cpuinfo import cpuinfo
         cpu_info = cpuinfo.get_cpu_info()
         sysinfo = {
             "arch": platform.machine(),
-            "dist": " ".join(list(platform.linux_distribution())),
+            "dist": " ".join(list(linux_distribution())),
             "cpu": cpu_info["brand"],
             "cores": cpu_info["count"]
         }
+        if self.sysinfo_cache is not None:
+            try:
+                with open(self.sysinfo_cache + ".tmp", "w") as cache:
+                    json.dump(sysinfo, cache)
+                os.replace(self.sysinfo_cache + ".tmp", self.sysinfo_cache)
+            except (IOError, OSError) as e:
+                self.logger.warning("Cannot cache system info in {}: {}".format(self.sysinfo_cache, e))
+        return sysinfo
 
-        try:
-            response = requests.get(configpath, params=sysinfo)
-            if response.status_code == 200:
-                server_config = response.json()
+    def start(self):
+        """Fetch the config on a background thread, ready is set once it is known.
+
+        Afterwards the config is fetched again every refresh_interval seconds,
+        listeners are called with the configuration after every change.
+        """
+        threading.Thread(target=self.run, name="configuration", daemon=True).start()
+
+    def run(self):
+        self.fetch()
+        # Failed refreshes are retried sooner, but never later than the regular refresh
+        backoff = Backoff(initial=10, maximum=self.refresh_interval)
+        while True:
+            sleep(backoff.delay or self.refresh_interval)
+            try:
+                self.refresh()
+                backoff.succeeded()
+            except (requests.exceptions.RequestException, ValueError) as e:
+                self.logger.error("Cannot refresh the config from {}: {}".format(self.transport.base, e))
+                backoff.failed()
+            except Exception:
+                self.logger.exception("Invalid config from {}".format(self.transport.base))
+                # Download it again instead of getting a 304 for the broken config
+                self.etag = None
+                backoff.failed()
+
+    def request(self):
+        """Download the server config, returns None when it didn't change since the last download."""
+        headers = {"If-None-Match": self.etag} if self.etag is not None else None
+        response = self.transport.get_config(self.sysinfo, headers=headers)
+        if response.status_code == 304:
+            return None
+        if response.status_code != 200:
+            raise requests.exceptions.HTTPError("Server error {}".format(response.status_code), response=response)
+        self.etag = response.headers.get("ETag")
+        return response.json()
+
+    def apply(self, server_config):
+        if server_config == self.server_config:
+            # Servers without ETag support send the same config again
+            return
+        # Read every required key first so a malformed config changes nothing
+        send_throttle = server_config["send_throttle"]
+        monitor_enabled = dict(server_config["monitor_enabled"])
+        monitor_interval = dict(server_config.get("monitor_interval") or {})
+        self.server_config = server_config
+        self.send_throttle = send_throttle
+        self.monitor_enabled = monitor_enabled
+        self.monitor_interval = monitor_interval
+        # Servers that don't know about encodings keep receiving the original format
+        if server_config.get("packet_encoding") in wire.ENCODINGS:
+            self.packet_encoding = server_config["packet_encoding"]
+        if server_config.get("packet_compression") in wire.COMPRESSIONS:
+            self.packet_compression = server_config["packet_compression"]
+        self.info_unchanged = bool(server_config.get("info_unchanged", False))
+        for listener in self.listeners:
+            try:
+                listener(self)
+            except Exception:
+                self.logger.exception("Cannot apply the new config")
+
+    def refresh(self):
+        server_config = self.request()
+        if server_config is None:
+            return
+        if not server_config["enabled"]:
+            self.logger.error("This client has been disabled on the server, keeping the last config")
+            return
+        self.logger.info("Config changed on the server")
+        self.apply(server_config)
+
+    def fetch(self):
+        self.logger.debug("Fetching {}".format(self.transport.url("config")))
+        self.sysinfo = dict(self.read_sysinfo())
+        self.sysinfo.update({
+            "encodings": ",".join(wire.ENCODINGS),
+            "compressions": ",".join(wire.COMPRESSIONS),
+            "features": "unchanged"
+        })
+
+        backoff = Backoff(initial=10)
+        while True:
+            try:
+                server_config = self.request()
+                if server_config is None:
+                    # Only possible with an ETag from an earlier attempt
+                    server_config = self.server_config
                 if not server_config["enabled"]:
                     self.logger.error("This client hasn't been accepted on the server yet.")
                     self.logger.info("Retrying in {} minutes".format(server_config["polling_time"]))
+                    self.server_config = server_config
                     sleep(60 * server_config["polling_time"])
-                    self.fetch()
-                else:
-                    self.logger.info("Config download successful")
-                    self.send_throttle = server_config["send_throttle"]
-                    self.monitor_enabled = server_config["monitor_enabled"]
-            else:
-                self.logger.error("Server error {} at http://{}".format(response.status_code, self.server))
-                exit(1)
-        except requests.exceptions.ConnectionError as e:
-            self.logger.error("Cannot connect to the server at http://{}".format(self.server))
-            exit(1)
\ No newline at end of file
+                    continue
+                self.logger.info("Config download successful")
+                self.apply(server_config)
+                self.ready.set()
+                return
+            except (requests.exceptions.HTTPError, ValueError) as e:
+                self.logger.error("Cannot get the config from {}: {}".format(self.transport.base, e))
+            except requests.exceptions.RequestException as e:
+                self.logger.error("Cannot connect to the server at {}".format(self.transport.base))
+            except Exception:
+                self.logger.exception("Invalid config from {}".format(self.transport.base))
+                self.etag = None
+            self.logger.info("Retrying in {} seconds".format(backoff.failed()))
+            sleep(backoff.delay)
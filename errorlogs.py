@@ -0,0 +1,20 @@
+from logtail import TailedLogs
+from apache_log import ErrorAggregate, parse_error_line
+
+
+class ErrorLogs(TailedLogs):
+    """Tails a set of error logs into a pending ErrorAggregate."""
+
+    kind = "error"
+
+    def __init__(self, ingest="inotify", max_messages=1000, top=10, logger=None):
+        self.max_messages = max_messages
+        self.top = top
+        super().__init__(ingest, logger)
+
+    def new_aggregate(self):
+        return ErrorAggregate(self.max_messages, self.top)
+
+    def parse(self, filename, lines, aggregate):
+        for line in lines:
+            aggregate.add(parse_error_line(line))
@@ -0,0 +1,196 @@
+import threading
+import json
+import re
+import socket
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# Dict keys below these keys are label values instead of metric name parts
+MAP_LABELS = {
+    "vhosts": "vhost",
+    "status": "status",
+    "paths": "path",
+    "time_ms": "le",
+    "monitors": "monitor",
+    "counters": "counter",
+    "levels": "level",
+    "modules": "module",
+    "codes": "code"
+}
+# Label for numeric keys and list indexes at the top level of a monitor's point
+ROOT_LABELS = {
+    "apache": "status",
+    "cpu": "cpu",
+    "processes": "rank",
+    "disks": "disk"
+}
+# Label for every key at the top level of a monitor's point
+ROOT_MAP_LABELS = {
+    "cgroups": "cgroup",
+    "diskio": "device"
+}
+
+class HTTPServerV6(HTTPServer):
+    address_family = socket.AF_INET6
+
+
+regex_invalid = re.compile(r'[^a-zA-Z0-9_]')
+
+
+def metric_name(parts):
+    return regex_invalid.sub("_", "_".join(str(part) for part in parts))
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def number(value):
+    if isinstance(value, bool):
+        return float(value)
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return None
+
+
+def samples(point, parts, labels, map_label=None, index_label=None):
+    """Yield (name parts, labels, value) for every numeric leaf of a point.
+
+    Every key of a dict below map_label is a label value, numeric keys and
+    list indexes become an index_label label.
+    """
+    value = number(point)
+    if value is not None:
+        yield parts, labels, value
+        return
+
+    if isinstance(point, list):
+        for index, item in enumerate(point):
+            item_labels = dict(labels)
+            item_labels[index_label or "index"] = index
+            if isinstance(item, dict):
+                # String fields of list items (mountpoint, process name, ...) describe the item
+                for key, field in item.items():
+                    if isinstance(field, str) and number(field) is None:
+                        item_labels[key] = field
+            for sample in samples(item, parts, item_labels):
+                yield sample
+    elif isinstance(point, dict):
+        for key, item in point.items():
+            if map_label is not None or number(key) is not None:
+                item_labels = dict(labels)
+                item_labels[map_label or index_label or "key"] = key
+                for sample in samples(item, parts, item_labels):
+                    yield sample
+            else:
+                for sample in samples(item, parts + [key], labels, map_label=MAP_LABELS.get(key)):
+                    yield sample
+
+
+class Exporter(object):
+    """Serves the latest result of every monitor in OpenMetrics text format.
+
+    Monitors hand their points over as they are collected, a scrape only
+    renders them, and the rendered page is cached until a new point
+    arrives. /raw/<monitor>?seconds=N returns the raw samples kept by the
+    rollup stage as JSON.
+    """
+
+    def __init__(self, address, port, logger, rollup=None):
+        self.logger = logger
+        self.rollup = rollup
+        self.lock = threading.Lock()
+        self.points = {}
+        self.version = 0
+        self.cache = (None, b"")
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                exporter.handle(self)
+
+            def log_message(self, format, *args):
+                exporter.logger.debug("Exporter: " + format % args)
+
+        server_class = HTTPServerV6 if ":" in address else HTTPServer
+        self.server = server_class((address, port), Handler)
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="exporter", daemon=True).start()
+
+    def update(self, monitor, point, stamp):
+        with self.lock:
+            self.points[monitor.name] = (point, stamp)
+            self.version += 1
+
+    def remove(self, name):
+        """Stop exporting a monitor that was stopped."""
+        with self.lock:
+            if self.points.pop(name, None) is not None:
+                self.version += 1
+
+    def render(self):
+        with self.lock:
+            if self.cache[0] == self.version:
+                return self.cache[1]
+            version = self.version
+            points = dict(self.points)
+
+        families = {}
+        for name in sorted(points.keys()):
+            point, stamp = points[name]
+            families.setdefault("brixmond_last_collect_timestamp_seconds", []).append(({"monitor": name}, stamp))
+            for parts, labels, value in samples(point, ["brixmond", name], {}, map_label=ROOT_MAP_LABELS.get(name),
+                                                index_label=ROOT_LABELS.get(name)):
+                families.setdefault(metric_name(parts), []).append((labels, value))
+
+        lines = []
+        for family in sorted(families.keys()):
+            lines.append("# TYPE {} gauge".format(family))
+            for labels, value in families[family]:
+                if labels:
+                    label_text = ",".join('{}="{}"'.format(metric_name([key]), escape(label))
+                                          for key, label in sorted(labels.items(), key=lambda item: str(item[0])))
+                    lines.append("{}{{{}}} {}".format(family, label_text, value))
+                else:
+                    lines.append("{} {}".format(family, value))
+        lines.append("# EOF\n")
+        body = "\n".join(lines).encode('UTF-8')
+
+        with self.lock:
+            self.cache = (version, body)
+        return body
+
+    def handle(self, request):
+        url = urlparse(request.path)
+        if url.path == "/metrics":
+            body = self.render()
+            content_type = CONTENT_TYPE
+        elif url.path.startswith("/raw/") and self.rollup is not None:
+            seconds = parse_qs(url.query).get("seconds", [None])[0]
+            try:
+                seconds = float(seconds) if seconds else None
+            except ValueError:
+                request.send_error(400, "seconds must be a number")
+                return
+            raw = self.rollup.raw(url.path[len("/raw/"):], seconds)
+            if raw is None:
+                request.send_error(404)
+                return
+            body = json.dumps(raw).encode('UTF-8')
+            content_type = "application/json"
+        else:
+            request.send_error(404)
+            return
+        request.send_response(200)
+        request.send_header("Content-Type", content_type)
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
@@ -0,0 +1,244 @@
+import logging
+import os
+import threading
+import time
+import inotify
+
+
+class LogTailer(object):
+    """Follow a log file by byte offset, surviving logrotate.
+
+    The file handle is kept open between reads so lines written to a rotated
+    file are drained before switching to the new file. A shrinking file is
+    treated as truncated (copytruncate) and read again from the start.
+    """
+
+    def __init__(self, path, chunk_size=64 * 1024, from_start=False, max_line=1024 * 1024):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.max_line = max_line
+        self.from_start = from_start
+        self.handle = None
+        self.inode = None
+        self.offset = 0
+        self.partial = b""
+
+    def _open(self, from_start):
+        try:
+            handle = open(self.path, "rb")
+        except (IOError, OSError):
+            return False
+        stat = os.fstat(handle.fileno())
+        self.handle = handle
+        self.inode = (stat.st_dev, stat.st_ino)
+        self.offset = 0 if from_start else stat.st_size
+        self.partial = b""
+        return True
+
+    def close(self):
+        if self.handle is not None:
+            self.handle.close()
+        self.handle = None
+        self.inode = None
+        self.partial = b""
+
+    def _drain(self):
+        if os.fstat(self.handle.fileno()).st_size < self.offset:
+            # Truncated in place, start over
+            self.offset = 0
+            self.partial = b""
+        self.handle.seek(self.offset)
+        while True:
+            chunk = self.handle.read(self.chunk_size)
+            if not chunk:
+                break
+            self.offset += len(chunk)
+            lines = (self.partial + chunk).split(b"\n")
+            self.partial = lines.pop()
+            if len(self.partial) > self.max_line:
+                self.partial = b""
+            for line in lines:
+                yield line.decode("utf-8", "replace")
+
+    def _rotated(self):
+        try:
+            stat = os.stat(self.path)
+        except (IOError, OSError):
+            # Moved away and not recreated yet, keep following the old file
+            return False
+        return (stat.st_dev, stat.st_ino) != self.inode
+
+    def read_lines(self):
+        """Yield every complete line appended since the previous call."""
+        if self.handle is None:
+            opened = self._open(self.from_start)
+            # Files appearing after the first attempt are new, read them whole
+            self.from_start = True
+            if not opened:
+                return
+        for line in self._drain():
+            yield line
+        if self._rotated():
+            self.close()
+            if self._open(True):
+                for line in self._drain():
+                    yield line
+
+
+class LogWatcher(threading.Thread):
+    """Calls callback(path) shortly after a watched log file changes.
+
+    The directories holding the logs are watched instead of the files
+    themselves, so files that logrotate moves away or recreates keep being
+    followed. Events arriving within latency seconds of each other are
+    handled together, and the thread sleeps while nothing is written.
+    """
+
+    MASK = inotify.IN_MODIFY | inotify.IN_CREATE | inotify.IN_MOVED_TO | inotify.IN_MOVED_FROM | inotify.IN_DELETE
+
+    def __init__(self, callback, logger, latency=1.0):
+        super().__init__(name="logwatcher", daemon=True)
+        self.callback = callback
+        self.logger = logger
+        self.latency = latency
+        self.inotify = inotify.Inotify()
+        self.lock = threading.Lock()
+        self.directories = {}
+        self.watches = {}
+        self.stopped = False
+
+    def watch(self, path):
+        """Start watching a file, returns False when its filesystem doesn't support inotify."""
+        directory, name = os.path.split(os.path.abspath(path))
+        with self.lock:
+            if directory not in self.directories:
+                try:
+                    wd = self.inotify.add_watch(directory, self.MASK)
+                except OSError as e:
+                    self.logger.warning("Cannot watch {}, polling it instead: {}".format(directory, e))
+                    return False
+                self.directories[directory] = wd
+                self.watches[wd] = {}
+            self.watches[self.directories[directory]][name] = path
+        return True
+
+    def unwatch(self, path):
+        directory, name = os.path.split(os.path.abspath(path))
+        with self.lock:
+            wd = self.directories.get(directory)
+            if wd is None:
+                return
+            self.watches[wd].pop(name, None)
+            if not self.watches[wd]:
+                self.inotify.rm_watch(wd)
+                del self.watches[wd]
+                del self.directories[directory]
+
+    def changed(self, events):
+        paths = set()
+        with self.lock:
+            for wd, mask, cookie, name in events:
+                if mask & inotify.IN_Q_OVERFLOW:
+                    # Events were lost, check every file
+                    for names in self.watches.values():
+                        paths.update(names.values())
+                elif wd in self.watches and name in self.watches[wd]:
+                    paths.add(self.watches[wd][name])
+        return paths
+
+    def stop(self):
+        self.stopped = True
+
+    def run(self):
+        while not self.stopped:
+            # Wake up now and then to notice stop()
+            paths = self.changed(self.inotify.read(5))
+            deadline = time.time() + self.latency
+            while time.time() < deadline:
+                paths.update(self.changed(self.inotify.read(deadline - time.time())))
+            for path in sorted(paths):
+                try:
+                    self.callback(path)
+                except Exception:
+                    self.logger.exception("Cannot process {}".format(path))
+        self.inotify.close()
+
+
+class TailedLogs(object):
+    """Tails a set of logs into a pending aggregate, the base of AccessLogs and ErrorLogs.
+
+    With inotify lines are parsed by a LogWatcher thread shortly after they
+    are written, files that can't be watched are read by take(). Every set
+    has its own watcher thread so one busy kind of log doesn't delay the
+    other. Subclasses create the aggregate and parse the lines into it.
+    """
+
+    kind = "log"
+
+    def __init__(self, ingest="inotify", logger=None):
+        self.tailers = {}
+        # Files on filesystems without inotify support are read on every tick
+        self.polled = set()
+        self.lock = threading.Lock()
+        self.read_lock = threading.Lock()
+        self.aggregate = self.new_aggregate()
+        logger = logger or logging.getLogger("brixmond")
+
+        self.watcher = None
+        if ingest == "inotify" and inotify.available():
+            try:
+                self.watcher = LogWatcher(self.ingest, logger)
+            except OSError as e:
+                logger.warning("Cannot use inotify, polling the {} logs instead: {}".format(self.kind, e))
+
+    def new_aggregate(self):
+        raise NotImplementedError()
+
+    def parse(self, filename, lines, aggregate):
+        """Add the lines read from filename to aggregate."""
+        raise NotImplementedError()
+
+    def start(self):
+        if self.watcher is not None:
+            self.watcher.start()
+
+    def add_log(self, filename):
+        self.tailers[filename] = LogTailer(filename)
+        if self.watcher is None or not self.watcher.watch(filename):
+            self.polled.add(filename)
+        # Start following the file at its current end
+        self.ingest(filename)
+
+    def remove_log(self, filename):
+        if self.watcher is not None:
+            self.watcher.unwatch(filename)
+        self.polled.discard(filename)
+        with self.read_lock:
+            tailer = self.tailers.pop(filename, None)
+            if tailer is not None:
+                tailer.close()
+
+    def ingest(self, filename):
+        """Parse the lines appended to one log into the pending aggregate."""
+        partial = self.new_aggregate()
+        with self.read_lock:
+            tailer = self.tailers.get(filename)
+            if tailer is None:
+                return
+            self.parse(filename, tailer.read_lines(), partial)
+        with self.lock:
+            self.aggregate.merge(partial)
+
+    def close(self):
+        for filename in list(self.tailers):
+            self.remove_log(filename)
+        if self.watcher is not None:
+            self.watcher.stop()
+
+    def take(self):
+        """Return the aggregate of everything read since the previous call."""
+        for filename in sorted(self.polled):
+            self.ingest(filename)
+        with self.lock:
+            aggregate, self.aggregate = self.aggregate, self.new_aggregate()
+        return aggregate
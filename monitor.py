@@ -1,6 +1,11 @@
-import threading
 import json
-import datetime
+import time
+import hashlib
+import threading
+
+# Called as hook(monitor, wall_seconds, cpu_seconds) after every collection
+collect_hooks = []
+thread_time = getattr(time, "thread_time", time.process_time)
 
 
 class Monitor(object):
@@ -8,26 +13,72 @@ class Monitor(object):
     def __init__(self):
         self.name = "monitor"
         self.type = "point"
-        self.interval = 1
+        self.interval = 60
+        self.timeout = None
 
-    def get_point(self):
+    def collect(self):
+        """Take a single measurement. Returning None skips this tick."""
         return {}
 
+    def close(self):
+        """Release threads, processes and files when the monitor is stopped."""
+        pass
+
+
+def make_result(monitor, point, stamp, result_type=None):
+    return {
+        "name": monitor.name,
+        "stamp": stamp,
+        "point": json.dumps(point, separators=(",", ":")),
+        "type": result_type or monitor.type
+    }
+
+
+def timed_collect(monitor):
+    """Run the collect step of a monitor and report its cost to collect_hooks."""
+    wall = time.perf_counter()
+    cpu = thread_time()
+    try:
+        return monitor.collect()
+    finally:
+        wall = time.perf_counter() - wall
+        cpu = thread_time() - cpu
+        for hook in collect_hooks:
+            hook(monitor, wall, cpu)
+
+
+class ChangeFilter(object):
+    """Replace unchanged info results with a small heartbeat.
+
+    Info monitors mostly report the same state over and over. The serialized
+    point is hashed and only sent again when it changed or when the last full
+    result is older than keyframe seconds. Otherwise an "unchanged" result
+    holding just the hash is sent. A full result that was dropped before
+    reaching the server has to be forgotten, else the server would get
+    heartbeats for a state it never received.
+    """
 
-class MonitorThread(threading.Thread):
+    def __init__(self, keyframe=60 * 60):
+        self.keyframe = keyframe
+        self.enabled = True
+        self.lock = threading.Lock()
+        self.sent = {}
 
-    def __init__(self, monitor, queue):
-        super().__init__()
-        self.monitor = monitor
-        self.name = monitor.name
-        self.type = monitor.type
-        self.queue = queue
+    def filter(self, monitor, result):
+        if not self.enabled or result["type"] != "info":
+            return result
+        digest = hashlib.sha1(result["point"].encode('UTF-8')).hexdigest()
+        with self.lock:
+            previous = self.sent.get(monitor.name)
+            if previous is not None and previous[0] == digest and result["stamp"] - previous[1] < self.keyframe:
+                return make_result(monitor, {"hash": digest}, result["stamp"], result_type="unchanged")
+            self.sent[monitor.name] = (digest, result["stamp"])
+        return result
 
-    def run(self):
-        for point in self.monitor.get_point():
-            self.queue.put({
-                "name": self.name,
-                "stamp": datetime.datetime.utcnow().isoformat(),
-                "point": json.dumps(point),
-                "type": self.type
-            })
\ No newline at end of file
+    def forget(self, name=None):
+        """Send the next result of a monitor, or of every monitor without a name, in full."""
+        with self.lock:
+            if name is None:
+                self.sent.clear()
+            else:
+                self.sent.pop(name, None)
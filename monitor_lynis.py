@@ -1,28 +1,57 @@
 from monitor import Monitor
-import configparser
-import sys
-from configparser import DuplicateOptionError, DuplicateSectionError, MissingSectionHeaderError
-from time import sleep
+import logging
 import shutil
+import signal
+import time
 import os
-from subprocess import call, DEVNULL
+from subprocess import Popen, DEVNULL
+
+REPORT_PATH = "/var/log/lynis-report.dat"
 
 
 class MonitorLynis(Monitor):
-    def __init__(self):
+    """Runs a Lynis audit every audit_interval seconds without blocking a worker.
+
+    Every tick only checks on the running audit, the report is sent once the
+    audit has finished.
+    """
+
+    def __init__(self, audit_interval=60 * 60, audit_timeout=30 * 60, cpu_limit=10 * 60, logger=None):
         super().__init__()
         self.name = "lynis"
         self.type = "info"
-        self.lynis = Lynis()
+        self.interval = 60
+        self.audit_interval = audit_interval
+        self.lynis = Lynis(timeout=audit_timeout, cpu_limit=cpu_limit, logger=logger)
+        self.last_audit = None
 
-    def get_point(self):
-        while True:
-            result = self.lynis.get_report()
-            yield result
-            sleep(60 * 60)
+    def collect(self):
+        if self.lynis.running():
+            if self.lynis.finished():
+                return self.lynis.get_report()
+            return None
+        if self.last_audit is None or time.time() - self.last_audit >= self.audit_interval:
+            self.last_audit = time.time()
+            self.lynis.start()
+        return None
+
+    def close(self):
+        self.lynis.stop()
 
 
 class Lynis(object):
+    """A supervised Lynis audit run at idle CPU and IO priority."""
+
+    def __init__(self, timeout=30 * 60, cpu_limit=10 * 60, report_path=REPORT_PATH, logger=None):
+        self.timeout = timeout
+        self.cpu_limit = cpu_limit
+        self.report_path = report_path
+        self.logger = logger or logging.getLogger("brixmond")
+        self.process = None
+        self.started = None
+        self.report_stat = None
+        self.report = None
+
     @staticmethod
     def installed():
         result = False
@@ -37,181 +66,102 @@ class Lynis(object):
 
         return result
 
-    @staticmethod
-    def get_report():
+    def command(self):
         if os.path.isfile("/opt/lynis/lynis"):
-            call(["/opt/lynis/lynis", "--auditor", "Brixmond", "-Q"], cwd="/opt/lynis", stdout=DEVNULL)
+            command, cwd = ["/opt/lynis/lynis", "--auditor", "Brixmond", "-Q"], "/opt/lynis"
         else:
-            call(["lynis", "--auditor", "Brixmond", "-Q"], stdout=DEVNULL)
-
-        report_format = "old"
-        with open("/var/log/lynis-report.dat") as report:
-            report_string = report.read()
-            if "[General]" not in report_string:
-                report_format = "new"
-                report_string = "[General]\n" + report_string
-
-        report_file = ConfigParserMultiOpt()
-        report_file.read_string(report_string)
-        report_warnings = {}
-        report_suggestions = {}
-        for section in report_file.sections():
-            if report_file.has_option(section, "warning[]"):
-                warnings = report_file[section]["warning[]"]
-                for warning in warnings:
-                    if report_format == "new":
-                        name, description, *rest = warning.split("|")
-                        prio = "U"
-                    else:
-                        name, prio, description, *rest = warning.split("|")
-
-                    report_warnings[name] = {
-                        "prio": prio,
-                        "description": description
-                    }
-            if report_file.has_option(section, "suggestion[]"):
-                suggestions = report_file[section]["suggestion[]"]
-                for suggestion in suggestions:
-                    if report_format == "new":
-                        name, description, *rest = suggestion.split("|")
-                        prio = "U"
-                    else:
-                        name, prio, description, *rest = suggestion.split("|")
-                    report_suggestions[name] = {
-                        "prio": prio,
-                        "description": description
-                    }
-        return {
-            "suggestions": report_suggestions,
-            "warnings": report_warnings,
-            "warning_count": len(report_warnings),
-            "suggestion_count": len(report_suggestions)
-        }
-
-
-# Code from http://stackoverflow.com/questions/13921323/handling-duplicate-keys-with-configparser
-class ConfigParserMultiOpt(configparser.RawConfigParser):
-    """ConfigParser allowing duplicate keys. Values are stored in a list"""
-
-    def __init__(self):
-        configparser.RawConfigParser.__init__(self, empty_lines_in_values=False, strict=False)
-
-    def _read(self, fp, fpname):
-        """Parse a sectioned configuration file.
-
-        Each section in a configuration file contains a header, indicated by
-        a name in square brackets (`[]'), plus key/value options, indicated by
-        `name' and `value' delimited with a specific substring (`=' or `:' by
-        default).
-
-        Values can span multiple lines, as long as they are indented deeper
-        than the first line of the value. Depending on the parser's mode, blank
-        lines may be treated as parts of multiline values or ignored.
-
-        Configuration files may include comments, prefixed by specific
-        characters (`#' and `;' by default). Comments may appear on their own
-        in an otherwise empty line or may be entered in lines holding values or
-        section names.
-        """
-        elements_added = set()
-        cursect = None  # None, or a dictionary
-        sectname = None
-        optname = None
-        lineno = 0
-        indent_level = 0
-        e = None  # None, or an exception
-        for lineno, line in enumerate(fp, start=1):
-            comment_start = None
-            # strip inline comments
-            for prefix in self._inline_comment_prefixes:
-                index = line.find(prefix)
-                if index == 0 or (index > 0 and line[index - 1].isspace()):
-                    comment_start = index
-                    break
-            # strip full line comments
-            for prefix in self._comment_prefixes:
-                if line.strip().startswith(prefix):
-                    comment_start = 0
-                    break
-            value = line[:comment_start].strip()
-            if not value:
-                if self._empty_lines_in_values:
-                    # add empty line to the value, but only if there was no
-                    # comment on the line
-                    if (comment_start is None and
-                                cursect is not None and
-                            optname and
-                                cursect[optname] is not None):
-                        cursect[optname].append('')  # newlines added at join
-                else:
-                    # empty line marks end of value
-                    indent_level = sys.maxsize
-                continue
-            # continuation line?
-            first_nonspace = self.NONSPACECRE.search(line)
-            cur_indent_level = first_nonspace.start() if first_nonspace else 0
-            if (cursect is not None and optname and
-                        cur_indent_level > indent_level):
-                cursect[optname].append(value)
-            # a section header or option header?
+            command, cwd = ["lynis", "--auditor", "Brixmond", "-Q"], None
+
+        # Every process lynis starts inherits the priorities and the CPU time limit
+        prefix = ["nice", "-n", "19"]
+        if shutil.which("ionice") is not None:
+            prefix += ["ionice", "-c", "3"]
+        if self.cpu_limit and shutil.which("prlimit") is not None:
+            prefix += ["prlimit", "--cpu={}".format(self.cpu_limit)]
+        return prefix + command, cwd
+
+    def start(self):
+        command, cwd = self.command()
+        self.started = time.time()
+        self.process = Popen(command, cwd=cwd, stdin=DEVNULL, stdout=DEVNULL, stderr=DEVNULL,
+                             start_new_session=True)
+
+    def stop(self):
+        if self.process is not None:
+            os.killpg(self.process.pid, signal.SIGKILL)
+            self.process.wait()
+            self.process = None
+
+    def running(self):
+        return self.process is not None
+
+    def finished(self):
+        """Check on the audit without waiting, kills it when it runs too long."""
+        returncode = self.process.poll()
+        if returncode is None:
+            if time.time() - self.started < self.timeout:
+                return False
+            self.logger.error("Lynis audit didn't finish in {} seconds, killing it".format(self.timeout))
+            self.stop()
+            return False
+        self.process = None
+        if returncode != 0:
+            self.logger.warning("Lynis audit exited with status {}".format(returncode))
+        return True
+
+    def get_report(self):
+        """The parsed report, only read again when the file changed."""
+        try:
+            stat = os.stat(self.report_path)
+        except OSError as e:
+            self.logger.error("Cannot read the Lynis report: {}".format(e))
+            return None
+        if (stat.st_mtime_ns, stat.st_size) != self.report_stat:
+            with open(self.report_path, errors="replace") as report:
+                self.report = parse_report(report)
+            self.report_stat = (stat.st_mtime_ns, stat.st_size)
+        return self.report
+
+
+def parse_report(lines):
+    """Extract the warning[] and suggestion[] entries from a lynis-report.dat.
+
+    Old reports are split in [sections] and have a priority field, newer
+    reports have no sections and no priority.
+    """
+    entries = {"warning": [], "suggestion": []}
+    sections = False
+    for line in lines:
+        line = line.strip()
+        if line.startswith("warning[]=") or line.startswith("suggestion[]="):
+            kind, value = line.split("[]=", 1)
+            entries[kind].append(value.strip())
+        elif line.startswith("["):
+            sections = True
+
+    result = {}
+    for kind, values in entries.items():
+        parsed = {}
+        for value in values:
+            fields = value.split("|")
+            if sections:
+                if len(fields) < 3:
+                    continue
+                name, prio, description = fields[:3]
             else:
-                indent_level = cur_indent_level
-                # is it a section header?
-                mo = self.SECTCRE.match(value)
-                if mo:
-                    sectname = mo.group('header')
-                    if sectname in self._sections:
-                        if self._strict and sectname in elements_added:
-                            raise DuplicateSectionError(sectname, fpname,
-                                                        lineno)
-                        cursect = self._sections[sectname]
-                        elements_added.add(sectname)
-                    elif sectname == self.default_section:
-                        cursect = self._defaults
-                    else:
-                        cursect = self._dict()
-                        self._sections[sectname] = cursect
-                        self._proxies[sectname] = configparser.SectionProxy(self, sectname)
-                        elements_added.add(sectname)
-                    # So sections can't start with a continuation line
-                    optname = None
-                # no section header in the file?
-                elif cursect is None:
-                    raise MissingSectionHeaderError(fpname, lineno, line)
-                # an option line?
-                else:
-                    mo = self._optcre.match(value)
-                    if mo:
-                        optname, vi, optval = mo.group('option', 'vi', 'value')
-                        if not optname:
-                            e = self._handle_error(e, fpname, lineno, line)
-                        optname = self.optionxform(optname.rstrip())
-                        if (self._strict and
-                                    (sectname, optname) in elements_added):
-                            raise configparser.DuplicateOptionError(sectname, optname, fpname, lineno)
-                        elements_added.add((sectname, optname))
-                        # This check is fine because the OPTCRE cannot
-                        # match if it would set optval to None
-                        if optval is not None:
-                            optval = optval.strip()
-                            # Check if this optname already exists
-                            if (optname in cursect) and (cursect[optname] is not None):
-                                # If it does, convert it to a tuple if it isn't already one
-                                if not isinstance(cursect[optname], tuple):
-                                    cursect[optname] = tuple(cursect[optname])
-                                cursect[optname] = cursect[optname] + tuple([optval])
-                            else:
-                                cursect[optname] = [optval]
-                        else:
-                            # valueless option handling
-                            cursect[optname] = None
-                    else:
-                        # a non-fatal parsing error occurred. set up the
-                        # exception but keep going. the exception will be
-                        # raised at the end of the file and will contain a
-                        # list of all bogus lines
-                        e = self._handle_error(e, fpname, lineno, line)
-        # if any parsing errors occurred, raise an exception
-        if e:
-            raise e
-        self._join_multiline_values()
\ No newline at end of file
+                if len(fields) < 2:
+                    continue
+                name, description = fields[:2]
+                prio = "U"
+            parsed[name] = {
+                "prio": prio,
+                "description": description
+            }
+        result[kind] = parsed
+
+    return {
+        "suggestions": result["suggestion"],
+        "warnings": result["warning"],
+        "warning_count": len(result["warning"]),
+        "suggestion_count": len(result["suggestion"])
+    }
@@ -1,92 +1,175 @@
 from monitor import Monitor
 import psutil
-from time import sleep
+import procnet
+import procsnap
+import os
+import time
 
 
 class MonitorCPU(Monitor):
-    def __init__(self):
+    def __init__(self, snapshot=None):
         super().__init__()
         self.name = "cpu"
         self.type = "point"
-
-    def get_point(self):
-        while True:
-            result = []
-            for cpu in psutil.cpu_times_percent(interval=60, percpu=True):
-                result.append(cpu.__dict__)
-            yield result
+        self.snapshot = snapshot or procsnap.shared()
+        # Percentages are measured since the previous call
+        if self.snapshot is not None:
+            self.cpus_old = self.snapshot.get().cpus
+        else:
+            psutil.cpu_times_percent(interval=None, percpu=True)
+
+    def collect(self):
+        if self.snapshot is not None:
+            cpus = self.snapshot.get().cpus
+            result = procsnap.cpu_percent(self.cpus_old, cpus)
+            self.cpus_old = cpus
+            return result
+
+        result = []
+        for cpu in psutil.cpu_times_percent(interval=None, percpu=True):
+            result.append(cpu.__dict__)
+        return result
 
 
 class MonitorMem(Monitor):
-    def __init__(self):
+    def __init__(self, snapshot=None):
         super().__init__()
         self.name = "mem"
         self.type = "point"
+        self.snapshot = snapshot or procsnap.shared()
+        self.page_size = os.sysconf("SC_PAGE_SIZE")
 
-    def get_point(self):
-        while True:
-            sleep(60)
-            yield {"mem": psutil.virtual_memory().__dict__, "swap": psutil.swap_memory().__dict__}
+    def collect(self):
+        if self.snapshot is not None:
+            snapshot = self.snapshot.get()
+            return {"mem": snapshot.virtual_memory(), "swap": snapshot.swap_memory(self.page_size)}
+        return {"mem": psutil.virtual_memory().__dict__, "swap": psutil.swap_memory().__dict__}
 
 
 class MonitorLoad(Monitor):
-    def __init__(self):
+    def __init__(self, snapshot=None):
         super().__init__()
         self.name = "load"
         self.type = "point"
+        self.snapshot = snapshot or procsnap.shared()
 
-    def get_point(self):
-        while True:
-            sleep(60)
-            with open("/proc/loadavg") as loadavg:
-                load = loadavg.read().split(" ")[:3]
-            yield load
+    def collect(self):
+        if self.snapshot is not None:
+            return self.snapshot.get().loadavg
+        with open("/proc/loadavg") as loadavg:
+            load = loadavg.read().split(" ")[:3]
+        return load
 
 
 class MonitorNetwork(Monitor):
-    def __init__(self):
+    def __init__(self, snapshot=None, proc_root="/proc"):
         super().__init__()
         self.name = "net"
         self.type = "point"
-
-    def get_point(self):
-        counters_old = psutil.net_io_counters().__dict__
-        while True:
-            sleep(60)
-            conn_counters = {
-                "ESTABLISHED": 0,
-                "SYN_SENT": 0,
-                "SYN_RECV": 0,
-                "CLOSING": 0,
-                "LISTEN": 0,
-                "TIME_WAIT": 0,
-                "LAST_ACK": 0,
-                "FIN_WAIT2": 0,
-                "FIN_WAIT1": 0,
-                "CLOSE_WAIT": 0,
-                "NONE": 0,
-            }
-
-            for connection in psutil.net_connections():
-                conn_counters[connection.status] += 1
-
-            conn_semantic = {
-                "connected": conn_counters["ESTABLISHED"],
-                "connecting": conn_counters["SYN_SENT"] + conn_counters["SYN_RECV"],
-                "closing": conn_counters["CLOSING"] + conn_counters["LAST_ACK"] + conn_counters["FIN_WAIT1"] +
-                           conn_counters["FIN_WAIT2"] + conn_counters["CLOSE_WAIT"] + conn_counters["TIME_WAIT"],
-                "listening": conn_counters["LISTEN"],
-                "unknown": conn_counters["NONE"]
-            }
-
-            counters = psutil.net_io_counters().__dict__
-            counters_delta = {key: counters[key] - counters_old.get(key, 0) for key in counters.keys()}
-            counters_old = counters
-            result = {
-                "counters": counters_delta,
-                "sockets": conn_semantic
+        self.snapshot = snapshot or procsnap.shared(proc_root)
+        self.counters_old = self.io_counters()
+        self.proc_root = proc_root
+        self.procnet = procnet.available(proc_root)
+
+    def io_counters(self):
+        if self.snapshot is not None:
+            return self.snapshot.get().net
+        return psutil.net_io_counters().__dict__
+
+    @staticmethod
+    def count_psutil_connections():
+        conn_counters = {
+            "ESTABLISHED": 0,
+            "SYN_SENT": 0,
+            "SYN_RECV": 0,
+            "CLOSING": 0,
+            "LISTEN": 0,
+            "TIME_WAIT": 0,
+            "LAST_ACK": 0,
+            "FIN_WAIT2": 0,
+            "FIN_WAIT1": 0,
+            "CLOSE_WAIT": 0,
+            "NONE": 0,
+        }
+
+        for connection in psutil.net_connections():
+            conn_counters[connection.status] += 1
+        return conn_counters
+
+    def collect(self):
+        if self.procnet:
+            conn_counters = procnet.count_socket_states(self.proc_root)
+        else:
+            conn_counters = self.count_psutil_connections()
+
+        conn_semantic = {
+            "connected": conn_counters["ESTABLISHED"],
+            "connecting": conn_counters["SYN_SENT"] + conn_counters["SYN_RECV"],
+            "closing": conn_counters["CLOSING"] + conn_counters["LAST_ACK"] + conn_counters["FIN_WAIT1"] +
+                       conn_counters["FIN_WAIT2"] + conn_counters["CLOSE_WAIT"] + conn_counters["TIME_WAIT"],
+            "listening": conn_counters["LISTEN"],
+            "unknown": conn_counters["NONE"]
+        }
+
+        counters = self.io_counters()
+        counters_delta = {key: counters[key] - self.counters_old.get(key, 0) for key in counters.keys()}
+        self.counters_old = counters
+        return {
+            "counters": counters_delta,
+            "sockets": conn_semantic
+        }
+
+
+class MonitorDiskIO(Monitor):
+    """Per disk IOPS, throughput, await and utilisation from /proc/diskstats deltas.
+
+    Only whole disks are reported, partitions and idle loop and ram devices
+    are skipped.
+    """
+
+    def __init__(self, proc_root="/proc", sys_root="/sys"):
+        super().__init__()
+        self.name = "diskio"
+        self.type = "point"
+        self.sys_root = sys_root
+        self.diskstats = procsnap.ProcFile(os.path.join(proc_root, "diskstats"))
+        self.disks = {}
+        self.stats_old = procsnap.parse_diskstats(self.diskstats.read())
+        self.time_old = time.monotonic()
+
+    def is_disk(self, device):
+        if device not in self.disks:
+            # Partitions have no entry of their own in /sys/block
+            self.disks[device] = not device.startswith(("loop", "ram")) and os.path.exists(
+                os.path.join(self.sys_root, "block", device.replace("/", "!")))
+        return self.disks[device]
+
+    def collect(self):
+        stats = procsnap.parse_diskstats(self.diskstats.read())
+        now = time.monotonic()
+        elapsed = max(now - self.time_old, 0.001)
+        result = {}
+        for device, new in stats.items():
+            old = self.stats_old.get(device)
+            if old is None or not self.is_disk(device):
+                continue
+            reads, read_sectors, read_ms, writes, write_sectors, write_ms, io_ms = [b - a for a, b in zip(old, new)]
+            if min(reads, writes, io_ms) < 0:
+                # Counter wrapped or the device was replaced
+                continue
+            result[device] = {
+                "read_iops": round(reads / elapsed, 2),
+                "write_iops": round(writes / elapsed, 2),
+                "read_bytes": round(read_sectors * 512 / elapsed),
+                "write_bytes": round(write_sectors * 512 / elapsed),
+                "read_await": round(read_ms / reads, 2) if reads else 0.0,
+                "write_await": round(write_ms / writes, 2) if writes else 0.0,
+                "await": round((read_ms + write_ms) / (reads + writes), 2) if reads + writes else 0.0,
+                "util": round(min(100.0, io_ms / (elapsed * 1000) * 100), 1)
             }
-            yield result
-
-
+        self.stats_old = stats
+        self.time_old = now
+        return result
 
+    def close(self):
+        self.diskstats.close()
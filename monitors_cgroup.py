@@ -0,0 +1,175 @@
+from monitor import Monitor
+import os
+import time
+from procsnap import ProcFile
+
+FILES = ("cpu.stat", "memory.current", "io.stat", "cpu.pressure", "memory.pressure", "io.pressure")
+
+
+def parse_flat_keyed(data):
+    """cpu.stat style "key value" lines."""
+    values = {}
+    for line in data.split(b"\n"):
+        fields = line.split()
+        if len(fields) == 2:
+            values[fields[0].decode()] = int(fields[1])
+    return values
+
+
+def parse_io_stat(data):
+    """Totals over every device of an io.stat file."""
+    totals = {"rbytes": 0, "wbytes": 0, "rios": 0, "wios": 0}
+    for line in data.split(b"\n"):
+        for field in line.split()[1:]:
+            key, _, value = field.partition(b"=")
+            key = key.decode()
+            if key in totals:
+                totals[key] += int(value)
+    return totals
+
+
+def parse_pressure(data):
+    """The total stall time in microseconds of the some and full lines of a PSI file."""
+    totals = {}
+    for line in data.split(b"\n"):
+        fields = line.split()
+        if fields and fields[-1].startswith(b"total="):
+            totals[fields[0].decode()] = int(fields[-1][6:])
+    return totals
+
+
+class Cgroup(object):
+    """The pre-opened stat files of one cgroup and their previous readings."""
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        for name in FILES:
+            try:
+                self.files[name] = ProcFile(os.path.join(path, name), size=4096)
+            except (IOError, OSError):
+                # Controller not enabled for this cgroup
+                pass
+        self.previous = None
+
+    def read(self):
+        sample = {}
+        if "cpu.stat" in self.files:
+            sample["cpu"] = parse_flat_keyed(self.files["cpu.stat"].read())
+        if "memory.current" in self.files:
+            sample["memory"] = int(self.files["memory.current"].read())
+        if "io.stat" in self.files:
+            sample["io"] = parse_io_stat(self.files["io.stat"].read())
+        for resource in ("cpu", "memory", "io"):
+            if resource + ".pressure" in self.files:
+                sample[resource + ".pressure"] = parse_pressure(self.files[resource + ".pressure"].read())
+        return sample
+
+    def close(self):
+        for handle in self.files.values():
+            handle.close()
+        self.files = {}
+
+
+class MonitorCgroups(Monitor):
+    """CPU, memory, io and pressure per slice or container from cgroup v2.
+
+    The cgroup tree is walked down to depth levels only every rescan seconds,
+    the stat files of every cgroup are kept open and re-read with pread so
+    sampling hundreds of cgroups stays cheap. CPU is in percent of one core,
+    io in bytes and operations per second and pressure in percent of the
+    time some or all tasks were stalled.
+    """
+
+    def __init__(self, root="/sys/fs/cgroup", depth=2, rescan=60):
+        super().__init__()
+        self.name = "cgroups"
+        self.type = "point"
+        self.root = root
+        self.depth = depth
+        self.rescan = rescan
+        self.cgroups = {}
+        self.scanned = 0
+        self.time_old = time.monotonic()
+        self.scan()
+
+    @staticmethod
+    def installed(root="/sys/fs/cgroup"):
+        return os.path.isfile(os.path.join(root, "cgroup.controllers"))
+
+    def walk(self, path, depth):
+        try:
+            entries = os.scandir(path)
+        except (IOError, OSError):
+            return
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    yield entry.path
+                    if depth > 1:
+                        for child in self.walk(entry.path, depth - 1):
+                            yield child
+
+    def scan(self):
+        found = set(self.walk(self.root, self.depth))
+        for path in set(self.cgroups) - found:
+            self.cgroups.pop(path).close()
+        for path in sorted(found - set(self.cgroups)):
+            self.cgroups[path] = Cgroup(path)
+        self.scanned = time.monotonic()
+
+    @staticmethod
+    def rate(new, old, key, elapsed):
+        if key not in new or key not in old:
+            return None
+        return max(0, new[key] - old[key]) / elapsed
+
+    def usage(self, sample, previous, elapsed):
+        result = {}
+        if "cpu" in sample:
+            usec = self.rate(sample["cpu"], previous.get("cpu", {}), "usage_usec", elapsed)
+            throttled = self.rate(sample["cpu"], previous.get("cpu", {}), "throttled_usec", elapsed)
+            if usec is not None:
+                result["cpu"] = round(usec / 10000, 2)
+            if throttled is not None:
+                result["cpu_throttled"] = round(throttled / 10000, 2)
+        if "memory" in sample:
+            result["memory"] = sample["memory"]
+        if "io" in sample and "io" in previous:
+            for key, name in (("rbytes", "read_bytes"), ("wbytes", "write_bytes"), ("rios", "read_iops"),
+                              ("wios", "write_iops")):
+                result[name] = round(self.rate(sample["io"], previous["io"], key, elapsed), 2)
+        for resource in ("cpu", "memory", "io"):
+            key = resource + ".pressure"
+            if key in sample and key in previous:
+                for kind in ("some", "full"):
+                    stalled = self.rate(sample[key], previous[key], kind, elapsed)
+                    if stalled is not None:
+                        result["pressure_{}_{}".format(resource, kind)] = round(stalled / 10000, 2)
+        return result
+
+    def collect(self):
+        if time.monotonic() - self.scanned >= self.rescan:
+            self.scan()
+        now = time.monotonic()
+        elapsed = max(now - self.time_old, 0.001)
+        self.time_old = now
+
+        result = {}
+        for path, cgroup in sorted(self.cgroups.items()):
+            try:
+                sample = cgroup.read()
+            except (IOError, OSError, ValueError):
+                # Removed since the last scan
+                self.cgroups.pop(path).close()
+                continue
+            usage = self.usage(sample, cgroup.previous, elapsed) if cgroup.previous is not None else None
+            if usage:
+                result[os.path.relpath(path, self.root)] = usage
+            cgroup.previous = sample
+        return result
+
+    def close(self):
+        for cgroup in self.cgroups.values():
+            cgroup.close()
+        self.cgroups = {}
@@ -1,30 +1,126 @@
 from monitor import Monitor
 import psutil
-from time import sleep
-import netifaces
+import os
+import time
+import heapq
+import select
+import threading
 
 
 class MonitorProcesses(Monitor):
-    def __init__(self):
+    """Top processes, read straight from /proc/[pid]/stat.
+
+    Only the cheap stat (and io when sorting by io) files are read for every
+    process. CPU usage is the delta against the previous run, and cmdline is
+    only read for the processes that make it into the top list.
+    """
+
+    SORT_KEYS = ("cpu", "rss", "io")
+
+    def __init__(self, count=5, sort="cpu", proc_root="/proc"):
         super().__init__()
         self.name = "processes"
         self.type = "info"
-        for process in psutil.process_iter():
-            process.cpu_percent()
-
-    def get_point(self):
-        while True:
-            sleep(120)
-            processes = []
+        self.interval = 120
+        self.count = count
+        self.sort = [key for key in sort.replace(" ", "").split(",") if key in self.SORT_KEYS] or ["cpu"]
+        self.proc_root = proc_root
+        self.procfs = os.path.isfile(os.path.join(proc_root, "self", "stat"))
+        if self.procfs:
+            self.clock_ticks = os.sysconf("SC_CLK_TCK")
+            self.page_size = os.sysconf("SC_PAGE_SIZE")
+            self.mem_total = self.read_mem_total()
+            self.previous = {}
+            self.previous_time = time.time()
+            self.read_processes()
+        else:
             for process in psutil.process_iter():
-                processes.append({
-                    "name": " ".join(process.cmdline()),
-                    "cpu": process.cpu_percent(),
-                    "mem": process.memory_percent()
-                })
+                process.cpu_percent()
 
-            sorted_processes = sorted(processes, key=lambda k: k['cpu'], reverse=True)
-            yield sorted_processes[0:5]
+    def read_mem_total(self):
+        with open(os.path.join(self.proc_root, "meminfo"), "rb") as meminfo:
+            for line in meminfo:
+                if line.startswith(b"MemTotal:"):
+                    return int(line.split()[1]) * 1024
+        return psutil.virtual_memory().total
+
+    def read_io(self, pid):
+        total = 0
+        try:
+            with open(os.path.join(self.proc_root, pid, "io"), "rb") as io:
+                for line in io:
+                    if line.startswith(b"read_bytes:") or line.startswith(b"write_bytes:"):
+                        total += int(line.split()[1])
+        except (IOError, OSError):
+            pass
+        return total
+
+    def read_processes(self):
+        """Return {pid: (starttime, cpu ticks, rss pages, io bytes)} for every process."""
+        read_io = "io" in self.sort
+        processes = {}
+        for pid in os.listdir(self.proc_root):
+            if not pid.isdigit():
+                continue
+            try:
+                with open(os.path.join(self.proc_root, pid, "stat"), "rb") as stat:
+                    # Skip past the command name, it may contain spaces and parentheses
+                    fields = stat.read().rsplit(b")", 1)[1].split()
+            except (IOError, OSError, IndexError):
+                continue
+            processes[pid] = (fields[19], int(fields[11]) + int(fields[12]), int(fields[21]),
+                              self.read_io(pid) if read_io else 0)
+        return processes
+
+    def read_cmdline(self, pid):
+        try:
+            with open(os.path.join(self.proc_root, pid, "cmdline"), "rb") as cmdline:
+                return cmdline.read().rstrip(b"\0").replace(b"\0", b" ").decode("UTF-8", "replace")
+        except (IOError, OSError):
+            return ""
+
+    def collect(self):
+        if not self.procfs:
+            return self.collect_psutil()
+
+        now = time.time()
+        elapsed = max(now - self.previous_time, 0.001)
+        current = self.read_processes()
+        candidates = []
+        for pid, (starttime, ticks, rss, io) in current.items():
+            previous = self.previous.get(pid)
+            # A reused pid has a different start time
+            if previous is None or previous[0] != starttime:
+                previous = (starttime, ticks, rss, io)
+            candidates.append({
+                "pid": pid,
+                "cpu": (ticks - previous[1]) / self.clock_ticks / elapsed * 100,
+                "rss": rss * self.page_size,
+                "io": io - previous[3]
+            })
+        self.previous = current
+        self.previous_time = now
+
+        top = heapq.nlargest(self.count, candidates, key=lambda k: tuple(k[key] for key in self.sort))
+        return [{
+            "name": self.read_cmdline(process["pid"]),
+            "cpu": round(process["cpu"], 1),
+            "mem": process["rss"] / self.mem_total * 100,
+            "rss": process["rss"],
+            "io": process["io"]
+        } for process in top]
+
+    def collect_psutil(self):
+        processes = []
+        for process in psutil.process_iter():
+            processes.append({
+                "name": " ".join(process.cmdline()),
+                "cpu": process.cpu_percent(),
+                "mem": process.memory_percent()
+            })
+
+        sorted_processes = sorted(processes, key=lambda k: k['cpu'], reverse=True)
+        return sorted_processes[0:self.count]
 
 
 class MonitorIP(Monitor):
@@ -33,35 +129,85 @@ class MonitorIP(Monitor):
         self.name = "ip"
         self.type = "info"
 
-    def get_point(self):
-        while True:
-            result = {}
-            for interface in netifaces.interfaces():
-                if interface != "lo":
-                    addresses = netifaces.ifaddresses(interface)
-                    block = {"v4": addresses[netifaces.AF_INET]}
-                    if netifaces.AF_INET6 in addresses:
-                        block["v6"] = addresses[netifaces.AF_INET6]
-                    result[interface] = block
-            yield result
-            sleep(60)
+    def collect(self):
+        import netifaces
+        result = {}
+        for interface in netifaces.interfaces():
+            if interface != "lo":
+                addresses = netifaces.ifaddresses(interface)
+                block = {"v4": addresses[netifaces.AF_INET]}
+                if netifaces.AF_INET6 in addresses:
+                    block["v6"] = addresses[netifaces.AF_INET6]
+                result[interface] = block
+        return result
 
 
 class MonitorDisks(Monitor):
-    def __init__(self):
+    """Capacity of every mounted filesystem.
+
+    The partition list is only read again after the kernel signals a mount
+    table change on /proc/self/mountinfo. Filesystems are stat'ed on a helper
+    thread, a mount that doesn't answer within stat_timeout seconds (a hung
+    NFS server) is reported without usage and skipped until it answers.
+    """
+
+    def __init__(self, stat_timeout=5):
         super().__init__()
         self.name = "disks"
         self.type = "info"
+        self.interval = 60 * 10
+        self.stat_timeout = stat_timeout
+        self.hung = {}
+        self.mountinfo = os.open("/proc/self/mountinfo", os.O_RDONLY)
+        self.poller = select.poll()
+        self.poller.register(self.mountinfo, select.POLLPRI | select.POLLERR)
+        self.partitions = psutil.disk_partitions()
+
+    def usage(self, mountpoint):
+        """Same fields as psutil.disk_usage(), or None when statvfs doesn't return in time."""
+        thread = self.hung.get(mountpoint)
+        if thread is not None:
+            if thread.is_alive():
+                return None
+            del self.hung[mountpoint]
+
+        result = {}
+
+        def stat():
+            result["vfs"] = os.statvfs(mountpoint)
+
+        thread = threading.Thread(target=stat, name="statvfs", daemon=True)
+        thread.start()
+        thread.join(self.stat_timeout)
+        if thread.is_alive():
+            self.hung[mountpoint] = thread
+            return None
+        if "vfs" not in result:
+            return None
+        vfs = result["vfs"]
+        total = vfs.f_blocks * vfs.f_frsize
+        free = vfs.f_bavail * vfs.f_frsize
+        used = (vfs.f_blocks - vfs.f_bfree) * vfs.f_frsize
+        return {
+            "total": total,
+            "used": used,
+            "free": free,
+            "percent": round(used / (used + free) * 100, 1) if used + free else 0.0
+        }
+
+    def collect(self):
+        # The kernel reports POLLPRI once per change of the mount table
+        if self.poller.poll(0):
+            self.partitions = psutil.disk_partitions()
+        result = []
+        for part in self.partitions:
+            result.append({
+                "mountpoint": part.mountpoint,
+                "device": part.device,
+                "fstype": part.fstype,
+                "usage": self.usage(part.mountpoint)
+            })
+        return result
 
-    def get_point(self):
-        while True:
-            result = []
-            for part in psutil.disk_partitions():
-                result.append({
-                    "mountpoint": part.mountpoint,
-                    "device": part.device,
-                    "fstype": part.fstype,
-                    "usage": psutil.disk_usage(part.mountpoint).__dict__
-                })
-            yield result
-            sleep(60 * 10)
\ No newline at end of file
+    def close(self):
+        os.close(self.mountinfo)
@@ -0,0 +1,78 @@
+from monitor import Monitor, collect_hooks
+import threading
+import collections
+import psutil
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    return {
+        "min": ordered[0],
+        "avg": sum(ordered) / len(ordered),
+        "p99": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    }
+
+
+class MonitorBrixmond(Monitor):
+    """Reports what the agent itself costs: per-monitor collection time, queue, uploads and footprint."""
+
+    def __init__(self, result_queue, transport, max_samples=1024):
+        super().__init__()
+        self.name = "brixmond"
+        self.type = "point"
+        self.result_queue = result_queue
+        self.transport = transport
+        self.process = psutil.Process()
+        self.max_samples = max_samples
+        self.lock = threading.Lock()
+        self.samples = self.new_samples()
+        self.uploads_old = dict(transport.stats)
+        collect_hooks.append(self.record)
+
+    def new_samples(self):
+        return collections.defaultdict(lambda: collections.deque(maxlen=self.max_samples))
+
+    def record(self, monitor, wall, cpu):
+        with self.lock:
+            self.samples[monitor.name].append((wall, cpu))
+
+    def close(self):
+        if self.record in collect_hooks:
+            collect_hooks.remove(self.record)
+
+    def collect(self):
+        with self.lock:
+            samples = self.samples
+            self.samples = self.new_samples()
+
+        monitors = {}
+        for name, timings in samples.items():
+            monitors[name] = {
+                "runs": len(timings),
+                "wall": summarize([timing[0] for timing in timings]),
+                "cpu": summarize([timing[1] for timing in timings])
+            }
+
+        with self.transport.lock:
+            uploads = dict(self.transport.stats)
+        delta = {key: uploads[key] - self.uploads_old[key] for key in uploads.keys()}
+        self.uploads_old = uploads
+
+        return {
+            "monitors": monitors,
+            "queue": {
+                "depth": self.result_queue.qsize(),
+                "bytes": self.result_queue.bytes
+            },
+            "sender": {
+                "packets": delta["uploads"],
+                "failures": delta["failures"],
+                "bytes": delta["bytes_sent"],
+                "latency_avg": delta["latency_total"] / delta["uploads"] if delta["uploads"] else 0,
+                "latency_last": uploads["latency_last"]
+            },
+            "process": {
+                "rss": self.process.memory_info().rss,
+                "threads": self.process.num_threads()
+            }
+        }
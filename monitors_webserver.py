@@ -1,20 +1,73 @@
 from monitor import Monitor
-import os, glob, re
-from time import sleep
-import apache_log_parser
+import os
+import logging
 import subprocess
 import json
 import shutil
-import copy
+import re
+import fnmatch
+from accesslogs import AccessLogs, AccessLogPool
+from apache_config import ApacheConfig
+from errorlogs import ErrorLogs
 
+LEGACY_VARNISH_COUNTERS = {
+    "main": {"miss": "MAIN.cache_miss", "hit": "MAIN.cache_hit", "conn": "MAIN.sess_conn", "drop": "MAIN.sess_drop"},
+    "client": {"miss": "cache_miss", "hit": "cache_hit", "conn": "client_conn", "drop": "client_drop"}
+}
 
-class MonitorApache(Monitor):
-    def __init__(self):
+DEFAULT_VARNISH_COUNTERS = ["MAIN.n_lru_nuked", "MAIN.threads", "MAIN.threads_failed", "MAIN.backend_fail",
+                            "MAIN.backend_unhealthy", "VBE.*.happy"]
+
+
+class ApacheLogMonitor(Monitor):
+    """Follows the logs found in the Apache config, shared by the access and error log monitors.
+
+    The ApacheConfig can be shared too, it is walked at most once every
+    discovery_interval seconds whichever monitor asks first.
+    """
+
+    def __init__(self, logs, discovery_interval=300, config=None, logger=None):
         super().__init__()
+        self.logger = logger or logging.getLogger("brixmond")
+        self.config = config or ApacheConfig()
+        self.discovery_interval = discovery_interval
+        self.logs = logs
+        self.tailed = {}
+        self.update_logs()
+        self.logs.start()
+
+    def discovered(self):
+        """{path: argument for add_log} of the logs in the config."""
+        raise NotImplementedError()
+
+    def update_logs(self):
+        """Start and stop tailing logs to match the discovered config."""
+        self.config.refresh_every(self.discovery_interval)
+        discovered = self.discovered()
+        for filename in sorted(self.tailed):
+            if filename not in discovered or discovered[filename] != self.tailed[filename]:
+                self.logger.info("Stopped reading {} log {}".format(self.logs.kind, filename))
+                self.logs.remove_log(filename)
+        for filename in sorted(discovered):
+            if filename not in self.tailed or discovered[filename] != self.tailed[filename]:
+                self.logger.info("Reading {} log {}".format(self.logs.kind, filename))
+                self.logs.add_log(filename, *discovered[filename])
+        self.tailed = discovered
+
+    def close(self):
+        self.logs.close()
+
+
+class MonitorApache(ApacheLogMonitor):
+    def __init__(self, vhosts=False, ingest="inotify", workers=0, discovery_interval=300, config=None, logger=None):
+        if workers > 0:
+            logs = AccessLogPool(workers, ingest, logger)
+        else:
+            logs = AccessLogs(ingest, logger)
+        super().__init__(logs, discovery_interval, config, logger)
         self.name = "apache"
         self.type = "point"
-        self.accesslogs, self.errorlogs = self.get_log_files()
-        self.logformats = self.get_log_formats()
+        self.vhosts = vhosts
 
     @staticmethod
     def installed():
@@ -27,80 +80,54 @@ class MonitorApache(Monitor):
 
         return result
 
-    def get_log_formats(self):
-        regex_logformat = re.compile(r'^[\t ]*LogFormat[\t ]+"(.+)"[\t ]+(.+)', re.MULTILINE | re.IGNORECASE)
-        config_files = ['/etc/apache2/apache2.conf'] + glob.glob('/etc/apache2/sites-enabled/*.conf') + glob.glob(
-            '/etc/apache2/conf-enabled/*.conf')
-
-        logformats = {}
-
-        for file in config_files:
-            with open(file) as config_file_handle:
-                lines = config_file_handle.read()
-                formats = regex_logformat.findall(lines)
-                for apache_format in formats:
-                    logformats[apache_format[1]] = apache_format[0].replace('\\"', '"')
-        return logformats
-
-    def get_log_files(self):
-        regex_errorlog = re.compile(r'^[\t ]*ErrorLog[\t ]([\w${}/\.]+)', re.MULTILINE | re.IGNORECASE)
-        regex_customlog = re.compile(r'^[\t ]*CustomLog[\t ]([\w${}/\.]+)[\t ]+([^ \n\t]+)', re.MULTILINE | re.IGNORECASE)
-        errorlogs = []
-        accesslogs = []
-
-        # TODO: Make distro independent
-        if os.path.isdir('/etc/apache2/sites-enabled'):
-            log_files = ['/etc/apache2/apache2.conf'] + glob.glob('/etc/apache2/sites-enabled/*.conf') + glob.glob(
-                '/etc/apache2/conf-enabled/*.conf')
-            for vhost_file in log_files:
-                with open(vhost_file) as vhost:
-                    lines = vhost.read()
-                    errorlogs = errorlogs + regex_errorlog.findall(lines)
-                    accesslogs = accesslogs + regex_customlog.findall(lines)
-        accesslogs_parsed = []
-        for line in accesslogs:
-            accesslogs_parsed.append((line[0].replace('${APACHE_LOG_DIR}', '/var/log/apache2'), line[1]))
-
-        errorlogs_parsed = []
-        for line in errorlogs:
-            errorlogs_parsed.append(line.replace('${APACHE_LOG_DIR}', '/var/log/apache2'))
-        return list(set(accesslogs_parsed)), list(set(errorlogs_parsed))
-
-    def get_point(self):
-        parsers = {}
-        for log_format in self.logformats.keys():
-            parsers[log_format] = apache_log_parser.make_parser(self.logformats[log_format])
-
-        last_linecount = {}
-        while True:
-            result = {}
-            for file in self.accesslogs:
-                filename = file[0]
-                fileformat = file[1]
-                with open(filename) as logfile:
-                    lines = logfile.readlines()
-                    start = 0
-                    if filename in last_linecount.keys() and len(lines) > last_linecount[filename]:
-                        start = last_linecount[filename]
-                        last_linecount[filename] = len(lines)
-                    new_lines = lines[start:]
-
-                    for line in new_lines:
-                        parsed = parsers[fileformat](line[:-1])
-                        status = int(parsed['status'])
-                        if status in result.keys():
-                            result[status] += 1
-                        else:
-                            result[status] = 1
-            yield result
-            sleep(60)
+    def discovered(self):
+        return {filename: (logformat,) for filename, logformat in self.config.accesslogs.items()}
+
+    def collect(self):
+        self.update_logs()
+        return self.logs.take().to_point(self.vhosts)
+
+
+class MonitorApacheErrors(ApacheLogMonitor):
+    """Error log counts per severity, module and AH code plus the most frequent messages."""
+
+    def __init__(self, ingest="inotify", top=10, max_messages=1000, discovery_interval=300, config=None,
+                 logger=None):
+        super().__init__(ErrorLogs(ingest, max_messages, top, logger), discovery_interval, config, logger)
+        self.name = "apache_errors"
+        self.type = "point"
+
+    def discovered(self):
+        return {filename: () for filename in self.config.errorlogs}
+
+    def collect(self):
+        self.update_logs()
+        return self.logs.take().to_point()
 
 
 class MonitorVarnish(Monitor):
-    def __init__(self):
+    """Varnish hit/miss and connection counts plus a configurable counter set.
+
+    varnishstat is asked for only the counters we report instead of a full
+    JSON dump. Counters (flag "c") are sent as the difference since the
+    previous tick, gauges and bitmaps as their current value.
+    """
+
+    def __init__(self, counters=None, command_timeout=10, logger=None):
         super().__init__()
         self.name = "varnish"
         self.type = "point"
+        self.counters = list(counters or DEFAULT_VARNISH_COUNTERS)
+        self.command_timeout = command_timeout
+        self.logger = logger or logging.getLogger("brixmond")
+        self.binary = shutil.which("varnishstat") or "/usr/bin/varnishstat"
+        self.version = self.get_version()
+        if self.version < (4, 0):
+            self.legacy = LEGACY_VARNISH_COUNTERS["client"]
+            # Varnish 3 has no MAIN. prefix and no globs
+            self.counters = [counter.split(".", 1)[-1] for counter in self.counters if "*" not in counter]
+        else:
+            self.legacy = LEGACY_VARNISH_COUNTERS["main"]
         self.lastStat = self.get_stats()
 
     @staticmethod
@@ -114,48 +141,88 @@ class MonitorVarnish(Monitor):
 
         return result
 
-    def get_point(self):
-        while True:
-            stat = self.get_stats()
-            yield self.diff_stats(stat, self.lastStat)
+    def get_version(self):
+        try:
+            result = subprocess.run([self.binary, "-V"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                    timeout=self.command_timeout)
+        except (OSError, subprocess.TimeoutExpired):
+            return (4, 0)
+        match = re.search(rb'varnish-(\d+)\.(\d+)', result.stdout)
+        if match is None:
+            return (4, 0)
+        return int(match.group(1)), int(match.group(2))
+
+    def command(self):
+        fields = sorted(set(self.counters) | set(self.legacy.values()))
+        if self.version < (4, 0):
+            return [self.binary, "-j", "-f", ",".join(fields)]
+        # -f is deprecated in favor of -I since Varnish 6.5
+        option = "-I" if self.version >= (6, 5) else "-f"
+        command = [self.binary, "-j"]
+        for field in fields:
+            command += [option, field]
+        return command
+
+    def collect(self):
+        stat = self.get_stats()
+        if not stat:
+            # Keep the previous counters so the next tick has correct deltas
+            return None
+        if not self.lastStat:
+            # No baseline yet, the totals aren't per tick counts
             self.lastStat = stat
-            sleep(60)
+            return None
+        result = self.diff_stats(stat, self.lastStat)
+        self.lastStat = stat
+        return result
 
-    def diff_stats(self, a, b):
-        if b['conn']['conn'] > a['conn']['conn']:
+    @staticmethod
+    def diff_counter(name, a, b):
+        value, flag = a[name]
+        if flag != "c" or name not in b:
+            return value
+        if value < b[name][0]:
             # Varnish is restarted
-            return copy.deepcopy(a)
+            return value
+        return value - b[name][0]
+
+    def diff_stats(self, a, b):
+        legacy = {key: self.diff_counter(name, a, b) if name in a else 0 for key, name in self.legacy.items()}
+        counters = {}
+        for name in sorted(a.keys()):
+            if any(fnmatch.fnmatchcase(name, pattern) for pattern in self.counters):
+                counters[name] = self.diff_counter(name, a, b)
         return {
             'cache': {
-                'miss': a['cache']['miss'] - b['cache']['miss'],
-                'hit': a['cache']['hit'] - b['cache']['hit']
+                'miss': legacy['miss'],
+                'hit': legacy['hit']
             },
             'conn': {
-                'conn': a['conn']['conn'] - b['conn']['conn'],
-                'drop': a['conn']['drop'] - b['conn']['drop']
-            }
+                'conn': legacy['conn'],
+                'drop': legacy['drop']
+            },
+            'counters': counters
         }
 
     def get_stats(self):
-        stats_raw = subprocess.Popen(["/usr/bin/varnishstat", "-j"], stdout=subprocess.PIPE).stdout.read()
-        stats = json.loads(stats_raw.decode('UTF-8'))
-        if 'MAIN.cache_miss' in stats:
-            cache_miss = 'MAIN.cache_miss'
-            cache_hit = 'MAIN.cache_hit'
-            conn_conn = 'MAIN.sess_conn'
-            conn_drop = 'MAIN.sess_drop'
-        else:
-            cache_miss = 'cache_miss'
-            cache_hit = 'cache_hit'
-            conn_conn = 'client_conn'
-            conn_drop = 'client_drop'
-        return {
-            'cache': {
-                'miss': stats[cache_miss]['value'],
-                'hit': stats[cache_hit]['value']
-            },
-            'conn': {
-                'conn': stats[conn_conn]['value'],
-                'drop': stats[conn_drop]['value']
-            }
-        }
\ No newline at end of file
+        """The requested counters as {name: (value, flag)}."""
+        try:
+            result = subprocess.run(self.command(), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                    timeout=self.command_timeout)
+        except subprocess.TimeoutExpired:
+            self.logger.error("varnishstat didn't answer in {} seconds".format(self.command_timeout))
+            return {}
+        try:
+            stats = json.loads(result.stdout.decode('UTF-8'))
+        except ValueError:
+            self.logger.error("varnishstat returned invalid JSON (exit code {})".format(result.returncode))
+            return {}
+        if not isinstance(stats, dict):
+            return {}
+        # Varnish 6.5 and later nest the counters
+        stats = stats.get('counters', stats)
+        counters = {}
+        for name, counter in stats.items():
+            if isinstance(counter, dict) and 'value' in counter:
+                counters[name] = (counter['value'], counter.get('flag', 'c'))
+        return counters
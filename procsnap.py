@@ -0,0 +1,190 @@
+import os
+import threading
+import time
+
+CPU_FIELDS = ("user", "nice", "system", "idle", "iowait", "irq", "softirq", "steal", "guest", "guest_nice")
+
+
+class ProcFile(object):
+    """A /proc file opened once and re-read from the start with pread."""
+
+    def __init__(self, path, size=16 * 1024):
+        self.path = path
+        self.size = size
+        self.fd = os.open(path, os.O_RDONLY)
+
+    def read(self):
+        # Files generated line by line, like net/dev and diskstats, return at
+        # most about a page per read, keep reading until the end
+        chunks = []
+        offset = 0
+        while True:
+            chunk = os.pread(self.fd, self.size, offset)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            offset += len(chunk)
+        if offset > self.size:
+            # Most files then fit in one read next time
+            self.size = offset
+        return b"".join(chunks)
+
+    def close(self):
+        os.close(self.fd)
+
+
+def parse_stat(data):
+    cpus = []
+    for line in data.split(b"\n"):
+        if line.startswith(b"cpu") and not line.startswith(b"cpu "):
+            cpus.append(tuple(int(value) for value in line.split()[1:len(CPU_FIELDS) + 1]))
+    return cpus
+
+
+def parse_meminfo(data):
+    meminfo = {}
+    for line in data.split(b"\n"):
+        fields = line.split()
+        if len(fields) >= 2:
+            meminfo[fields[0].rstrip(b":").decode()] = int(fields[1]) * (1024 if len(fields) > 2 else 1)
+    return meminfo
+
+
+def parse_vmstat(data):
+    vmstat = {}
+    for line in data.split(b"\n"):
+        if line.startswith(b"pswpin ") or line.startswith(b"pswpout "):
+            key, value = line.split()
+            vmstat[key.decode()] = int(value)
+    return vmstat
+
+
+def parse_net_dev(data):
+    totals = [0] * 16
+    for line in data.split(b"\n")[2:]:
+        if b":" not in line:
+            continue
+        values = line.split(b":", 1)[1].split()
+        totals = [total + int(value) for total, value in zip(totals, values)]
+    return {
+        "bytes_recv": totals[0],
+        "packets_recv": totals[1],
+        "errin": totals[2],
+        "dropin": totals[3],
+        "bytes_sent": totals[8],
+        "packets_sent": totals[9],
+        "errout": totals[10],
+        "dropout": totals[11]
+    }
+
+
+def parse_diskstats(data):
+    """{device: (reads, sectors read, ms reading, writes, sectors written, ms writing, ms doing io)}"""
+    devices = {}
+    for line in data.split(b"\n"):
+        fields = line.split()
+        if len(fields) < 14:
+            continue
+        devices[fields[2].decode()] = (int(fields[3]), int(fields[5]), int(fields[6]), int(fields[7]),
+                                       int(fields[9]), int(fields[10]), int(fields[12]))
+    return devices
+
+
+class Snapshot(object):
+    def __init__(self, stamp, cpus, meminfo, vmstat, loadavg, net):
+        self.stamp = stamp
+        self.cpus = cpus
+        self.meminfo = meminfo
+        self.vmstat = vmstat
+        self.loadavg = loadavg
+        self.net = net
+
+    def virtual_memory(self):
+        """Same fields and semantics as psutil.virtual_memory()."""
+        total = self.meminfo["MemTotal"]
+        free = self.meminfo["MemFree"]
+        buffers = self.meminfo.get("Buffers", 0)
+        cached = self.meminfo.get("Cached", 0)
+        available = free + buffers + cached
+        return {
+            "total": total,
+            "available": available,
+            "percent": round((total - available) / total * 100, 1) if total else 0.0,
+            "used": total - free,
+            "free": free,
+            "active": self.meminfo.get("Active", 0),
+            "inactive": self.meminfo.get("Inactive", 0),
+            "buffers": buffers,
+            "cached": cached
+        }
+
+    def swap_memory(self, page_size):
+        """Same fields and semantics as psutil.swap_memory()."""
+        total = self.meminfo.get("SwapTotal", 0)
+        free = self.meminfo.get("SwapFree", 0)
+        used = total - free
+        return {
+            "total": total,
+            "used": used,
+            "free": free,
+            "percent": round(used / total * 100, 1) if total else 0.0,
+            "sin": self.vmstat.get("pswpin", 0) * page_size,
+            "sout": self.vmstat.get("pswpout", 0) * page_size
+        }
+
+
+class SystemSnapshot(object):
+    """Reads /proc/stat, meminfo, vmstat, loadavg and net/dev once per tick.
+
+    The files stay open and are re-read with pread. A snapshot younger than
+    max_age seconds is handed out again, so monitors running on the same
+    tick share one read and one timestamp.
+    """
+
+    def __init__(self, proc_root="/proc", max_age=0.5):
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.files = {name: ProcFile(os.path.join(proc_root, name))
+                      for name in ("stat", "meminfo", "vmstat", "loadavg", "net/dev")}
+        self.snapshot = None
+
+    def get(self):
+        with self.lock:
+            now = time.time()
+            if self.snapshot is None or now - self.snapshot.stamp > self.max_age:
+                self.snapshot = Snapshot(
+                    stamp=now,
+                    cpus=parse_stat(self.files["stat"].read()),
+                    meminfo=parse_meminfo(self.files["meminfo"].read()),
+                    vmstat=parse_vmstat(self.files["vmstat"].read()),
+                    loadavg=[value.decode() for value in self.files["loadavg"].read().split(b" ")[:3]],
+                    net=parse_net_dev(self.files["net/dev"].read())
+                )
+            return self.snapshot
+
+
+# One SystemSnapshot per proc root
+shared_snapshots = {}
+shared_lock = threading.Lock()
+
+
+def shared(proc_root="/proc"):
+    """The process wide SystemSnapshot of proc_root, or None when it can't be read."""
+    with shared_lock:
+        if proc_root not in shared_snapshots:
+            try:
+                shared_snapshots[proc_root] = SystemSnapshot(proc_root)
+            except (IOError, OSError):
+                return None
+        return shared_snapshots[proc_root]
+
+
+def cpu_percent(old, new):
+    """Per CPU time percentages between two /proc/stat readings, like psutil.cpu_times_percent()."""
+    result = []
+    for before, after in zip(old, new):
+        deltas = [max(0, b - a) for a, b in zip(before, after)]
+        # guest time is already included in user and nice
+        total = sum(deltas[:8]) or 1
+        result.append({field: round(delta / total * 100, 1) for field, delta in zip(CPU_FIELDS, deltas)})
+    return result
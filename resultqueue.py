@@ -0,0 +1,90 @@
+import threading
+import collections
+import json
+import time
+
+# Rough per-entry overhead of the result dict on top of the serialized point
+ENTRY_OVERHEAD = 200
+
+
+class ResultQueue(object):
+    """Bounded queue between the monitors and the sender.
+
+    The queue holds at most max_items results and max_bytes of serialized
+    points. Monitors with the "oldest" policy lose their oldest results when
+    the queue is full, monitors with the "latest" policy only ever keep
+    their newest result queued. By default info monitors use "latest" and
+    point monitors "oldest". Everything dropped is counted per monitor, and
+    drop_listeners are called with the name of every dropped info result.
+    """
+
+    def __init__(self, max_items=10000, max_bytes=1024 * 1024 * 16):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.cond = threading.Condition()
+        self.items = collections.deque()
+        self.bytes = 0
+        self.policies = {}
+        self.dropped = collections.Counter()
+        self.drop_listeners = []
+
+    @staticmethod
+    def size(entry):
+        return len(entry["point"]) + ENTRY_OVERHEAD
+
+    def policy(self, entry):
+        return self.policies.get(entry["name"], "latest" if entry["type"] == "info" else "oldest")
+
+    def _drop(self, entry):
+        self.bytes -= self.size(entry)
+        self.dropped[entry["name"]] += 1
+        if entry["type"] == "info":
+            for listener in self.drop_listeners:
+                listener(entry["name"])
+
+    def put(self, entry):
+        with self.cond:
+            if entry["type"] == "unchanged":
+                # Anything already queued for this monitor says more than a heartbeat
+                for queued in self.items:
+                    if queued["name"] == entry["name"]:
+                        return
+            elif self.policy(entry) == "latest":
+                for queued in [queued for queued in self.items if queued["name"] == entry["name"]]:
+                    self.items.remove(queued)
+                    self._drop(queued)
+            self.items.append(entry)
+            self.bytes += self.size(entry)
+            while len(self.items) > self.max_items or (self.bytes > self.max_bytes and len(self.items) > 1):
+                self._drop(self.items.popleft())
+            self.cond.notify()
+
+    def get_batch(self, max_items, timeout=None):
+        """Take up to max_items results, waiting up to timeout for the first one."""
+        with self.cond:
+            if not self.items:
+                self.cond.wait(timeout)
+            batch = []
+            while self.items and len(batch) < max_items:
+                entry = self.items.popleft()
+                self.bytes -= self.size(entry)
+                batch.append(entry)
+            return batch
+
+    def qsize(self):
+        with self.cond:
+            return len(self.items)
+
+    def drop_report(self):
+        """Return a result with the drop counters since the last report, if anything was dropped."""
+        with self.cond:
+            if not self.dropped:
+                return None
+            dropped = dict(self.dropped)
+            self.dropped.clear()
+        return {
+            "name": "dropped",
+            "stamp": time.time(),
+            "point": json.dumps(dropped, separators=(",", ":")),
+            "type": "point"
+        }
@@ -0,0 +1,164 @@
+import array
+import math
+import threading
+import time
+from monitor import make_result
+
+
+def flatten(point, prefix=""):
+    """Yield (key, value) for every numeric leaf, keys are dotted paths."""
+    if isinstance(point, dict):
+        items = point.items()
+    elif isinstance(point, (list, tuple)):
+        items = enumerate(point)
+    else:
+        try:
+            yield prefix, float(point)
+        except (TypeError, ValueError):
+            pass
+        return
+    for key, value in items:
+        for leaf in flatten(value, "{}.{}".format(prefix, key) if prefix else str(key)):
+            yield leaf
+
+
+class RingBuffer(object):
+    """Fixed size array of doubles overwriting the oldest value."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.data = array.array('d', [math.nan]) * capacity
+        self.count = 0
+
+    def append(self, value):
+        self.data[self.count % self.capacity] = value
+        self.count += 1
+
+    def last(self, n):
+        """The last n values (at most capacity), oldest first."""
+        n = min(n, self.count, self.capacity)
+        end = self.count % self.capacity
+        if n <= end:
+            return self.data[end - n:end]
+        return self.data[self.capacity - (n - end):] + self.data[:end]
+
+
+def summarize(values):
+    values = sorted(value for value in values if not math.isnan(value))
+    if not values:
+        return None
+    return {
+        "min": values[0],
+        "max": values[-1],
+        "avg": sum(values) / len(values),
+        "p95": values[min(len(values) - 1, int(math.ceil(len(values) * 0.95)) - 1)]
+    }
+
+
+class Series(object):
+    """Raw samples of one monitor, one ring buffer per numeric field."""
+
+    def __init__(self, monitor, capacity):
+        self.monitor = monitor
+        self.capacity = capacity
+        self.stamps = RingBuffer(capacity)
+        self.fields = {}
+        self.flushed = 0
+
+    def add(self, point, stamp):
+        self.stamps.append(stamp)
+        seen = set()
+        for key, value in flatten(point):
+            if key not in self.fields:
+                self.fields[key] = RingBuffer(self.capacity)
+                # Keep the new field aligned with the stamps
+                self.fields[key].count = self.stamps.count - 1
+            self.fields[key].append(value)
+            seen.add(key)
+        for key, field in self.fields.items():
+            if key not in seen:
+                field.append(math.nan)
+
+    def pending(self):
+        return self.stamps.count - self.flushed
+
+    def rollup(self):
+        samples = min(self.pending(), self.capacity)
+        self.flushed = self.stamps.count
+        values = {}
+        for key, field in self.fields.items():
+            summary = summarize(field.last(samples))
+            if summary is not None:
+                values[key] = summary
+        return {
+            "samples": samples,
+            "interval": self.monitor.interval,
+            "values": values
+        }
+
+    def raw(self, seconds, now):
+        samples = min(self.stamps.count, self.capacity)
+        stamps = self.stamps.last(samples)
+        first = 0
+        while first < len(stamps) and stamps[first] < now - seconds:
+            first += 1
+        return {
+            "stamps": stamps[first:].tolist(),
+            "values": {key: [None if math.isnan(value) else value for value in field.last(samples)[first:]]
+                       for key, field in self.fields.items()}
+        }
+
+
+class Rollup(object):
+    """Pre-aggregates high resolution numeric monitors before they are sent.
+
+    Samples of the configured monitors are kept in ring buffers holding
+    raw_seconds of history. Once per window a "rollup" result with the
+    min/max/avg/p95 of every numeric field in that window is emitted instead
+    of every raw sample.
+    """
+
+    def __init__(self, monitors, window, raw_seconds=600):
+        self.monitors = set(monitors)
+        self.window = window
+        self.raw_seconds = raw_seconds
+        self.lock = threading.Lock()
+        self.series = {}
+        self.next_flush = (math.floor(time.time() / window) + 1) * window
+
+    def offer(self, monitor, point, stamp):
+        """Take the point if this monitor is rolled up, returns whether it was taken."""
+        if monitor.name not in self.monitors:
+            return False
+        with self.lock:
+            series = self.series.get(monitor.name)
+            if series is None or series.monitor is not monitor:
+                capacity = max(1, int(math.ceil(self.raw_seconds / monitor.interval)))
+                series = self.series[monitor.name] = Series(monitor, capacity)
+            series.add(point, stamp)
+        return True
+
+    def time_left(self):
+        return max(0, self.next_flush - time.time())
+
+    def flush(self):
+        """Return the rollup results for the windows that have ended."""
+        now = time.time()
+        if now < self.next_flush:
+            return []
+        stamp = math.floor(now / self.window) * self.window
+        self.next_flush = stamp + self.window
+        results = []
+        with self.lock:
+            for series in self.series.values():
+                if series.pending() > 0:
+                    results.append(make_result(series.monitor, series.rollup(), stamp, result_type="rollup"))
+        return results
+
+    def raw(self, name, seconds=None):
+        """The raw samples of a monitor for the last seconds, for on demand inspection."""
+        with self.lock:
+            series = self.series.get(name)
+            if series is None:
+                return None
+            return series.raw(self.raw_seconds if seconds is None else seconds, time.time())
@@ -0,0 +1,189 @@
+import threading
+import heapq
+import queue
+import logging
+import math
+import time
+import itertools
+from monitor import timed_collect
+
+
+class Job(object):
+    def __init__(self, monitor):
+        self.monitor = monitor
+        self.next_run = None
+        self.running = False
+        self.deadline = None
+        self.abandoned = False
+        self.removed = False
+        # Close the monitor once the running collect returns
+        self.close_after = False
+        self.skipped = 0
+
+    @property
+    def timeout(self):
+        return self.monitor.timeout or self.monitor.interval
+
+
+class Scheduler(object):
+    """Run the collect step of every monitor from one timer thread.
+
+    Ticks are aligned to multiples of each monitor's interval so monitors
+    sharing an interval get the same timestamp and collection time never
+    causes drift. Collection happens on a small pool of worker threads. A
+    monitor that is still running when its next tick is due is skipped, and
+    one that exceeds its timeout is abandoned and its worker replaced.
+    """
+
+    def __init__(self, emit, workers=2, logger=None):
+        self.emit = emit
+        self.size = workers
+        self.logger = logger or logging.getLogger('brixmond')
+        self.cond = threading.Condition()
+        self.heap = []
+        self.jobs = {}
+        self.counter = itertools.count()
+        self.work = queue.Queue()
+        self.workers = 0
+        self.stopped = False
+        self.thread = None
+
+    @staticmethod
+    def next_tick(interval, now):
+        return (math.floor(now / interval) + 1) * interval
+
+    def add(self, monitor):
+        with self.cond:
+            if monitor.name in self.jobs:
+                self.jobs[monitor.name].removed = True
+            job = Job(monitor)
+            self.jobs[monitor.name] = job
+            self._schedule(job, self.next_tick(monitor.interval, time.time()))
+            self.cond.notify()
+        return job
+
+    def set_interval(self, name, interval):
+        """Change the interval of a scheduled monitor, the new interval starts at its next aligned tick."""
+        with self.cond:
+            job = self.jobs.get(name)
+            if job is None or job.monitor.interval == interval:
+                return
+            job.monitor.interval = interval
+            # The old heap entry goes stale because next_run changes
+            self._schedule(job, self.next_tick(interval, time.time()))
+            self.cond.notify()
+
+    def remove(self, name, close=False):
+        """Unschedule a monitor, with close it is closed too, after the collect that may still be running."""
+        with self.cond:
+            job = self.jobs.pop(name, None)
+            if job is None:
+                return None
+            job.removed = True
+            if close and job.running:
+                job.close_after = True
+                close = False
+        if close:
+            self._close(job)
+        return job
+
+    def start(self):
+        with self.cond:
+            for i in range(self.size - self.workers):
+                self._spawn_worker()
+        self.thread = threading.Thread(target=self._run, name="scheduler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+            for i in range(self.workers):
+                self.work.put(None)
+
+    def _schedule(self, job, due):
+        job.next_run = due
+        heapq.heappush(self.heap, (due, next(self.counter), job))
+
+    def _close(self, job):
+        try:
+            job.monitor.close()
+        except Exception:
+            self.logger.exception("Cannot close monitor {}".format(job.monitor.name))
+
+    def _spawn_worker(self):
+        self.workers += 1
+        threading.Thread(target=self._work, name="worker", daemon=True).start()
+
+    def _check_timeouts(self, now):
+        wake = None
+        for job in self.jobs.values():
+            if not job.running or job.abandoned:
+                continue
+            if job.deadline <= now:
+                self.logger.error("Monitor {} exceeded its {}s timeout, abandoning it".format(job.monitor.name,
+                                                                                             job.timeout))
+                job.abandoned = True
+                self._spawn_worker()
+            elif wake is None or job.deadline < wake:
+                wake = job.deadline
+        return wake
+
+    def _run(self):
+        with self.cond:
+            while not self.stopped:
+                now = time.time()
+                wake = self._check_timeouts(now)
+                if self.heap:
+                    due, seq, job = self.heap[0]
+                    if job.removed or job.next_run != due:
+                        heapq.heappop(self.heap)
+                        continue
+                    if due <= now:
+                        heapq.heappop(self.heap)
+                        self._dispatch(job, due)
+                        interval = job.monitor.interval
+                        following = due + interval
+                        if following <= now:
+                            following = self.next_tick(interval, now)
+                        self._schedule(job, following)
+                        continue
+                    if wake is None or due < wake:
+                        wake = due
+                self.cond.wait(None if wake is None else wake - now)
+
+    def _dispatch(self, job, stamp):
+        if job.running:
+            job.skipped += 1
+            self.logger.warning("Monitor {} is still running, skipping tick".format(job.monitor.name))
+            return
+        job.running = True
+        job.abandoned = False
+        job.deadline = time.time() + job.timeout
+        self.work.put((job, stamp))
+
+    def _work(self):
+        while True:
+            item = self.work.get()
+            if item is None:
+                return
+            job, stamp = item
+            try:
+                point = timed_collect(job.monitor)
+            except Exception:
+                self.logger.exception("Monitor {} failed".format(job.monitor.name))
+                point = None
+            with self.cond:
+                job.running = False
+                abandoned = job.abandoned
+                close = job.close_after
+            if point is not None and not abandoned and not job.removed:
+                self.emit(job.monitor, point, stamp)
+            if close:
+                self._close(job)
+            if abandoned:
+                with self.cond:
+                    # A replacement was started when this call timed out
+                    if self.workers > self.size:
+                        self.workers -= 1
+                        return
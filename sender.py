@@ -0,0 +1,97 @@
+import threading
+import queue
+import time
+import wire
+from spool import Backoff
+
+
+class Sender(threading.Thread):
+    """Uploads packets on its own thread so the network never blocks collection.
+
+    Packets handed over while an upload is in progress wait in a short
+    outbox; when that is full they go straight to the spool. Spooled packets
+    are replayed oldest-first before new ones are sent. Until the config is
+    fetched every packet is spooled.
+    """
+
+    def __init__(self, transport, config, spool, logger, outbox_size=2):
+        super().__init__(name="sender", daemon=True)
+        self.transport = transport
+        self.config = config
+        self.spool = spool
+        self.logger = logger
+        self.backoff = Backoff()
+        self.outbox = queue.Queue(maxsize=outbox_size)
+
+    def submit(self, packet):
+        try:
+            self.outbox.put_nowait(packet)
+        except queue.Full:
+            self.logger.warning("Sender is busy, spooling {} results".format(len(packet)))
+            try:
+                self.spool.put(packet)
+            except Exception:
+                # Runs on the main thread, losing a packet beats stopping collection
+                self.logger.exception("Cannot spool packet, dropping {} results".format(len(packet)))
+
+    def send(self, packet):
+        body, headers = wire.encode_packet(packet, self.config.packet_encoding, self.config.packet_compression)
+        return self.transport.post_packet(body, headers)
+
+    def failed(self):
+        """Back off after a failed upload, at least as long as the server asked for."""
+        delay = self.backoff.failed()
+        if self.transport.retry_after is not None:
+            delay = self.backoff.postpone(self.transport.retry_after)
+        return delay
+
+    def replay_spool(self):
+        while True:
+            spooled = self.spool.peek()
+            if spooled is None:
+                return True
+            packet_id, packet = spooled
+            self.logger.debug("Replaying {} spooled results".format(len(packet)))
+            if not self.send(packet):
+                return False
+            self.spool.remove(packet_id)
+
+    def run(self):
+        while True:
+            try:
+                self.step()
+            except Exception:
+                # A broken spool must not stop uploads for good
+                delay = self.backoff.failed()
+                self.logger.exception("Sender failed, retrying in {} seconds".format(delay))
+                time.sleep(delay)
+
+    def step(self):
+        """Send or spool one packet from the outbox, or replay the spool when it is idle."""
+        try:
+            packet = self.outbox.get(timeout=self.config.send_throttle)
+        except queue.Empty:
+            packet = None
+
+        if not self.config.ready.is_set():
+            # Encoding and acceptance are unknown until the server answered
+            if packet is not None:
+                self.spool.put(packet)
+            return
+
+        if packet is not None:
+            delivered = False
+            if self.backoff.ready() and self.replay_spool():
+                self.logger.debug("Sending {} results to the server".format(len(packet)))
+                delivered = self.send(packet)
+            if delivered:
+                self.backoff.succeeded()
+            else:
+                self.spool.put(packet)
+                if self.backoff.ready():
+                    self.logger.info("Spooled packet, retrying in {} seconds".format(self.failed()))
+        elif self.backoff.ready() and len(self.spool) > 0:
+            if self.replay_spool():
+                self.backoff.succeeded()
+            else:
+                self.failed()
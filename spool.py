@@ -0,0 +1,121 @@
+import sqlite3
+import json
+import zlib
+import os
+import time
+import random
+import threading
+
+
+class Backoff(object):
+    """Exponential backoff with jitter between retries."""
+
+    def __init__(self, initial=5, maximum=60 * 15):
+        self.initial = initial
+        self.maximum = maximum
+        self.delay = 0
+        self.next_attempt = 0
+
+    def ready(self):
+        return time.time() >= self.next_attempt
+
+    def failed(self):
+        self.delay = min(self.maximum, self.delay * 2 if self.delay else self.initial)
+        self.next_attempt = time.time() + self.delay * random.uniform(0.8, 1.2)
+        return self.delay
+
+    def postpone(self, seconds):
+        """Wait at least seconds before the next attempt, capped at maximum."""
+        seconds = min(seconds, self.maximum)
+        self.delay = max(self.delay, seconds)
+        self.next_attempt = max(self.next_attempt, time.time() + seconds)
+        return self.delay
+
+    def succeeded(self):
+        self.delay = 0
+        self.next_attempt = 0
+
+
+class Spool(object):
+    """On-disk FIFO of packets that could not be delivered to the server.
+
+    Packets are stored compressed in SQLite so they survive restarts. The
+    oldest packets are discarded once the spool grows beyond max_bytes or
+    when they are older than max_age seconds, discard_listeners are called
+    after that happened. Only one packet is held in memory at a time while
+    replaying.
+    """
+
+    def __init__(self, path, max_bytes=1024 * 1024 * 50, max_age=60 * 60 * 24 * 7):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.discard_listeners = []
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS packets ("
+                        "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                        "stamp REAL NOT NULL, "
+                        "size INTEGER NOT NULL, "
+                        "data BLOB NOT NULL)")
+        self.db.commit()
+
+    def put(self, packet):
+        data = zlib.compress(json.dumps(packet).encode('UTF-8'))
+        with self.lock:
+            self.db.execute("INSERT INTO packets (stamp, size, data) VALUES (?, ?, ?)",
+                            (time.time(), len(data), sqlite3.Binary(data)))
+            self._trim()
+            self.db.commit()
+
+    def peek(self):
+        """Return (id, packet) for the oldest spooled packet or None, undecodable packets are discarded."""
+        while True:
+            with self.lock:
+                self._expire()
+                row = self.db.execute("SELECT id, data FROM packets ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            try:
+                return row[0], json.loads(zlib.decompress(row[1]).decode('UTF-8'))
+            except (zlib.error, ValueError):
+                # A corrupt row would block the replay forever
+                with self.lock:
+                    self._discarded(self.db.execute("DELETE FROM packets WHERE id = ?", (row[0],)))
+                    self.db.commit()
+
+    def remove(self, packet_id):
+        with self.lock:
+            self.db.execute("DELETE FROM packets WHERE id = ?", (packet_id,))
+            self.db.commit()
+
+    def size(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM packets").fetchone()
+
+    def __len__(self):
+        return self.size()[0]
+
+    def _discarded(self, cursor):
+        if cursor.rowcount > 0:
+            for listener in self.discard_listeners:
+                listener()
+
+    def _expire(self):
+        self._discarded(self.db.execute("DELETE FROM packets WHERE stamp < ?", (time.time() - self.max_age,)))
+
+    def _trim(self):
+        self._expire()
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM packets").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        last_id = None
+        for packet_id, size in self.db.execute("SELECT id, size FROM packets ORDER BY id"):
+            total -= size
+            last_id = packet_id
+            if total <= self.max_bytes:
+                break
+        self._discarded(self.db.execute("DELETE FROM packets WHERE id <= ?", (last_id,)))
@@ -0,0 +1,76 @@
+import threading
+import time
+import email.utils
+import requests
+import requests.exceptions
+
+
+class Transport(object):
+    """Keep-alive HTTP(S) session to the Brixmond server."""
+
+    def __init__(self, server, fqdn, secret, logger, https=False, verify=True, connect_timeout=5, read_timeout=30):
+        self.fqdn = fqdn
+        self.secret = secret
+        self.logger = logger
+        self.base = "{}://{}".format("https" if https else "http", server)
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        self.session.verify = verify
+        self.lock = threading.Lock()
+        self.stats = {
+            "uploads": 0,
+            "failures": 0,
+            "bytes_sent": 0,
+            "latency_last": 0.0,
+            "latency_total": 0.0
+        }
+        # Seconds the server asked to wait with Retry-After on the last failed upload
+        self.retry_after = None
+
+    def url(self, kind):
+        return "{}/client/{}/{}/{}".format(self.base, kind, self.fqdn, self.secret)
+
+    def get_config(self, params, headers=None):
+        return self.session.get(self.url("config"), params=params, headers=headers, timeout=self.timeout)
+
+    @staticmethod
+    def parse_retry_after(value):
+        """Retry-After as seconds, it is either a number of seconds or an HTTP date."""
+        if value is None:
+            return None
+        try:
+            return max(0, int(value))
+        except ValueError:
+            pass
+        try:
+            return max(0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def post_packet(self, body, headers):
+        """Upload an encoded packet, returns False when it should be retried later.
+
+        Server errors, 408 Request Timeout and 429 Too Many Requests are
+        retried, any Retry-After of those is kept in retry_after.
+        """
+        self.retry_after = None
+        start = time.time()
+        try:
+            response = self.session.post(self.url("packet"), data=body, headers=headers, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            self.logger.error("Cannot send packet to {}: {}".format(self.base, e))
+            with self.lock:
+                self.stats["failures"] += 1
+            return False
+        latency = time.time() - start
+        self.logger.debug("Server response: {} in {:.3f}s".format(response.status_code, latency))
+        with self.lock:
+            self.stats["latency_last"] = latency
+            if response.status_code >= 500 or response.status_code in (408, 429):
+                self.stats["failures"] += 1
+                self.retry_after = self.parse_retry_after(response.headers.get("Retry-After"))
+                return False
+            self.stats["uploads"] += 1
+            self.stats["latency_total"] += latency
+            self.stats["bytes_sent"] += len(body)
+        return True
@@ -0,0 +1,115 @@
+import json
+import gzip
+import datetime
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ENCODINGS = ["json", "columnar"]
+COMPRESSIONS = ["gzip"] + (["zstd"] if zstandard is not None else [])
+
+
+def encode_json(packet):
+    """The original format, a list of entries with the point as a JSON string."""
+    return json.dumps([{
+        "name": entry["name"],
+        "stamp": datetime.datetime.utcfromtimestamp(entry["stamp"]).isoformat(timespec="microseconds"),
+        "point": entry["point"],
+        "type": entry["type"]
+    } for entry in packet])
+
+
+def encode_columnar(packet):
+    """Compact format with interned names and types and delta encoded stamps.
+
+    {"v": 1, "base": <epoch ms>, "names": [...], "types": [...],
+     "entries": [[name index, type index, ms since previous entry, point], ...]}
+
+    The already serialized points are embedded as-is instead of being
+    encoded a second time.
+    """
+    names = {}
+    types = {}
+    entries = []
+    base = int(round(packet[0]["stamp"] * 1000)) if packet else 0
+    previous = base
+    for entry in packet:
+        stamp = int(round(entry["stamp"] * 1000))
+        name_index = names.setdefault(entry["name"], len(names))
+        type_index = types.setdefault(entry["type"], len(types))
+        entries.append("[{},{},{},{}]".format(name_index, type_index, stamp - previous, entry["point"]))
+        previous = stamp
+    return '{{"v":1,"base":{},"names":{},"types":{},"entries":[{}]}}'.format(
+        base, json.dumps(sorted(names, key=names.get)), json.dumps(sorted(types, key=types.get)), ",".join(entries))
+
+
+def encode_packet(packet, encoding="json", compression=None):
+    """Return the request body and headers for a list of results."""
+    if encoding == "columnar":
+        body = encode_columnar(packet).encode('UTF-8')
+        headers = {"Content-Type": "application/vnd.brixmond.columnar+json"}
+    else:
+        body = encode_json(packet).encode('UTF-8')
+        headers = {"Content-Type": "application/json"}
+
+    if compression == "gzip":
+        body = gzip.compress(body)
+        headers["Content-Encoding"] = "gzip"
+    elif compression == "zstd" and zstandard is not None:
+        body = zstandard.ZstdCompressor().compress(body)
+        headers["Content-Encoding"] = "zstd"
+    return body, headers
+
+
+class Batch(object):
+    """Collects results until enough are gathered or the oldest is too old.
+
+    Ticks are aligned, so every agent starts a batch at the same moment. A
+    batch is due at the first wall clock multiple of max_age, shifted by
+    phase (0-1) times max_age, after its first result instead of exactly
+    max_age later, so agents with different phases don't upload together.
+    """
+
+    def __init__(self, max_age, max_items=1000, max_bytes=256 * 1024, phase=0.0):
+        self.max_age = max_age
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.phase = phase
+        self.entries = []
+        self.bytes = 0
+        self.started = None
+
+    def add(self, entry):
+        if not self.entries:
+            self.started = time.time()
+        self.entries.append(entry)
+        self.bytes += len(entry["point"])
+
+    def __len__(self):
+        return len(self.entries)
+
+    def full(self):
+        return len(self.entries) >= self.max_items or self.bytes >= self.max_bytes
+
+    def due(self):
+        """The time the pending results have to be sent."""
+        offset = self.phase * self.max_age
+        return self.started + self.max_age - (self.started - offset) % self.max_age
+
+    def time_left(self):
+        if not self.entries:
+            return self.max_age
+        return max(0, self.due() - time.time())
+
+    def ready(self):
+        return len(self.entries) > 0 and (self.full() or self.time_left() == 0)
+
+    def take(self):
+        entries = self.entries
+        self.entries = []
+        self.bytes = 0
+        self.started = None
+        return entries